@@ -1,12 +1,21 @@
+import time
 import streamlit as st
-from backend.db import init_db, check_database_availability, create_database_backup
-from backend.auth import create_default_users, authenticate
+from backend.db import init_db, check_database_availability
+from backend.incremental_backup import start_wal_archiver
+from backend.log_archive import archive_old_logs
+from backend.auth import (create_default_users, authenticate, get_lockout_remaining, has_legacy_password_hashes,
+                          migrate_legacy_password_hashes)
 from backend.logs import log_action
+from backend.metrics import REGISTRY, start_metrics_exporter
+from backend.sql_trace import get_current_view, set_current_view
 from frontend.layout import show_header, show_footer, show_gdpr_notice
 from frontend.admin_view import render_admin_view
 from frontend.doctor_view import render_doctor_view
 from frontend.receptionist_view import render_receptionist_view
 
+PAGE_RENDER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_page_render_seconds = REGISTRY.histogram("hms_page_render_seconds", "Dashboard script run time by role and page.",
+                                          ("role", "page"), buckets=PAGE_RENDER_BUCKETS)
 
 # -------------------------
 # 🎨 CUSTOM GLOBAL CSS THEME
@@ -131,20 +140,41 @@ st.set_page_config(
 # -------------------------
 # INITIALIZATION
 # -------------------------
-def initialize_app():
+@st.cache_resource(show_spinner=False)
+def _initialize_once():
+    # Cached for the life of the server process: reruns skip the DDL,
+    # default-user check and startup backup entirely.
+    db_available = check_database_availability()
+    init_db()
+    create_default_users()
+    # Legacy SHA-256 rows no longer verify until wrapped. The probe is one
+    # query; the worker pool is only started when there is work.
+    if has_legacy_password_hashes():
+        migrate_legacy_password_hashes()
+    # Full base on the first start of a chain, then only the WAL frames
+    # committed since; the archiver keeps extending it in the background.
+    backup = start_wal_archiver()
+    # Roll finished months out of the hot logs table; a no-op most starts.
     try:
-        db_available = check_database_availability()
-        init_db()
-        create_default_users()
-        backup_path = create_database_backup()
-
-        if db_available and backup_path:
-            print("[APP] Application initialized with backup protection.")
-        elif db_available:
-            print("[APP] Application initialized (backup not created).")
-        else:
-            print("[APP] Application initialized with new database created.")
+        archive_old_logs()
+    except Exception as e:
+        print(f"[APP WARNING] Log archiving skipped: {e}")
+    # /metrics on localhost for a Prometheus scraper; see backend/metrics.py.
+    start_metrics_exporter()
+
+    if db_available and backup:
+        print("[APP] Application initialized with backup protection.")
+    elif db_available:
+        print("[APP] Application initialized (backup not created).")
+    else:
+        print("[APP] Application initialized with new database created.")
+
+    return backup
 
+
+def initialize_app():
+    try:
+        _initialize_once()
     except Exception as e:
         st.error(f"Failed to initialize application: {e}")
         print(f"[APP ERROR] Initialization failed: {e}")
@@ -186,6 +216,11 @@ def render_login_page():
                         st.session_state["user"] = user
                         st.success(f"Welcome, {user['username']}!")
                         st.rerun()
+                    elif get_lockout_remaining(username_clean):
+                        st.error(
+                            f"Too many failed attempts. Try again in "
+                            f"{get_lockout_remaining(username_clean):.0f} seconds."
+                        )
                     else:
                         st.error("Invalid username or password.")
 
@@ -209,6 +244,9 @@ def render_dashboard():
 
     show_header(user)
 
+    # The sidebar sets the view ("role/page") while the role view renders.
+    set_current_view(None)
+    started = time.perf_counter()
     try:
         if user["role"] == "admin":
             render_admin_view(user)
@@ -222,6 +260,11 @@ def render_dashboard():
     except Exception as e:
         st.error(f"Error loading dashboard: {e}")
 
+    # Runs cut short by st.rerun()/st.stop() never get here, so only
+    # complete renders are counted.
+    page = (get_current_view() or "").partition("/")[2] or "unknown"
+    _page_render_seconds.observe(time.perf_counter() - started, role=user["role"], page=page)
+
     show_footer()
 
 
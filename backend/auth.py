@@ -1,5 +1,13 @@
 import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from .db import get_connection
+from .metrics import REGISTRY
 
 try:
     import bcrypt
@@ -8,60 +16,271 @@ except ImportError:
     BCRYPT_AVAILABLE = False
 
 USE_BCRYPT = True
+BCRYPT_ROUNDS = 12
+
+# Legacy rows hold an unsalted SHA-256 hex digest. They are converted in
+# place to bcrypt over that digest, marked with this prefix, and replaced by
+# a plain bcrypt hash on the user's next login.
+WRAPPED_HASH_PREFIX = "$sha256-bcrypt$"
+HASH_MIGRATION_CHUNK_SIZE = 8
+HASH_MIGRATION_WORKERS = min(8, os.cpu_count() or 1)
+
+# bcrypt runs on a small pool instead of the Streamlit script thread; logins
+# beyond AUTH_MAX_PENDING in flight are turned away rather than queued.
+AUTH_WORKERS = min(4, os.cpu_count() or 1)
+AUTH_MAX_PENDING = 32
+AUTH_VERIFY_TIMEOUT = 10.0
+
+# After LOCKOUT_THRESHOLD consecutive failures a username is locked for
+# LOCKOUT_BASE_SECONDS, doubling with each further failure.
+LOCKOUT_THRESHOLD = 5
+LOCKOUT_BASE_SECONDS = 1.0
+LOCKOUT_MAX_SECONDS = 900.0
+FAILED_ATTEMPT_TTL = 3600.0
+FAILED_ATTEMPT_MAX_ENTRIES = 10000
+
+LOGIN_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOGIN_OUTCOMES = ("success", "failure", "locked", "busy", "error")
+
+
+class AuthBusyError(RuntimeError):
+    pass
 
 
 def hash_password(password: str) -> str:
     if USE_BCRYPT and BCRYPT_AVAILABLE:
-        salt = bcrypt.gensalt(rounds=12)
+        salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
         return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
     else:
         return hashlib.sha256(password.encode("utf-8")).hexdigest()
 
 
+def _sha256_hex(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+def is_legacy_hash(password_hash: str) -> bool:
+    return len(password_hash) == 64 and all(c in "0123456789abcdef" for c in password_hash)
+
+
+def wrap_legacy_hash(legacy_hash: str) -> str:
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return WRAPPED_HASH_PREFIX + bcrypt.hashpw(legacy_hash.encode("ascii"), salt).decode("utf-8")
+
+
 def verify_password(password: str, password_hash: str) -> bool:
     try:
         if not password_hash:
             return False
         
         if USE_BCRYPT and BCRYPT_AVAILABLE:
-            if password_hash.startswith("$2") or password_hash.startswith("$2a$") or password_hash.startswith("$2b$"):
+            if password_hash.startswith(WRAPPED_HASH_PREFIX):
+                wrapped = password_hash[len(WRAPPED_HASH_PREFIX):]
+                return bcrypt.checkpw(_sha256_hex(password).encode("ascii"), wrapped.encode("utf-8"))
+            if password_hash.startswith("$2"):
                 return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
-            else:
-                provided_hash = hashlib.sha256(password.encode("utf-8")).hexdigest()
-                return provided_hash == password_hash
+            # Unconverted SHA-256 rows are not accepted here; see
+            # migrate_legacy_password_hashes().
+            return False
         else:
-            provided_hash = hashlib.sha256(password.encode("utf-8")).hexdigest()
-            return provided_hash == password_hash
+            return hmac.compare_digest(_sha256_hex(password), password_hash)
     except Exception as e:
         print(f"[AUTH ERROR] Password verification failed: {e}")
         return False
 
 
+def _wrap_legacy_rows(rows: list) -> list:
+    return [(wrap_legacy_hash(legacy_hash), user_id, legacy_hash) for user_id, legacy_hash in rows]
+
+
+def has_legacy_password_hashes() -> bool:
+    # is_legacy_hash in SQL; stops at the first match, so it is cheap
+    # enough to run on every start.
+    with get_connection() as conn:
+        return bool(conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM users WHERE length(password_hash) = 64 "
+            "AND password_hash NOT GLOB '*[^0-9a-f]*');"
+        ).fetchone()[0])
+
+
+def migrate_legacy_password_hashes(workers: int = HASH_MIGRATION_WORKERS,
+                                   chunk_size: int = HASH_MIGRATION_CHUNK_SIZE) -> dict:
+    # bcrypt is CPU-bound, so chunks are hashed in worker processes; each
+    # chunk is written back with one executemany as it completes.
+    result = {"converted": 0, "skipped": 0, "seconds": 0.0}
+    if not (USE_BCRYPT and BCRYPT_AVAILABLE):
+        print("[AUTH] bcrypt unavailable; legacy password hashes left as they are.")
+        return result
+
+    started = time.perf_counter()
+    with get_connection() as conn:
+        rows = conn.execute("SELECT id, password_hash FROM users WHERE password_hash NOT LIKE '$%';").fetchall()
+    legacy = [(row["id"], row["password_hash"]) for row in rows if is_legacy_hash(row["password_hash"])]
+    result["skipped"] = len(rows) - len(legacy)
+    if not legacy:
+        return result
+
+    chunks = [legacy[i:i + chunk_size] for i in range(0, len(legacy), chunk_size)]
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        for wrapped in pool.map(_wrap_legacy_rows, chunks):
+            with get_connection() as conn:
+                # The old-hash guard skips rows changed since they were read.
+                cur = conn.executemany(
+                    "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?;", wrapped
+                )
+                conn.commit()
+            result["converted"] += cur.rowcount
+
+    result["seconds"] = time.perf_counter() - started
+    print(
+        f"[AUTH] Wrapped {result['converted']} legacy SHA-256 password hashes in bcrypt "
+        f"({result['seconds']:.1f}s, {result['skipped']} unrecognised rows skipped)"
+    )
+    return result
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(AUTH_MAX_PENDING)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+        return _executor
+
+
+def _offload(fn, *args):
+    # bcrypt releases the GIL, so the pool hashes in parallel while callers
+    # only wait on the result.
+    if not _pending.acquire(blocking=False):
+        raise AuthBusyError("Too many logins in progress")
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _pending.release()
+        raise
+    # Released when the work ends, not when a caller gives up waiting.
+    future.add_done_callback(lambda _: _pending.release())
+    return future.result(timeout=AUTH_VERIFY_TIMEOUT)
+
+
+_dummy_hash = None
+_dummy_hash_lock = threading.Lock()
+
+
+def _get_dummy_hash() -> str:
+    # Unknown usernames are checked against this, so they cost the same
+    # hash as a real account and do not show up in response times.
+    global _dummy_hash
+    with _dummy_hash_lock:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password(secrets.token_hex(16))
+        return _dummy_hash
+
+
+class FailedAttemptTracker:
+    # Per-username failure counts, in memory only. Unknown usernames are
+    # tracked too, so a lockout says nothing about whether an account exists.
+    def __init__(self, threshold: int = LOCKOUT_THRESHOLD, base: float = LOCKOUT_BASE_SECONDS,
+                 maximum: float = LOCKOUT_MAX_SECONDS, ttl: float = FAILED_ATTEMPT_TTL,
+                 max_entries: int = FAILED_ATTEMPT_MAX_ENTRIES):
+        self.threshold = threshold
+        self.base = base
+        self.maximum = maximum
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # username -> [failures, locked_until, last_failure]
+        self._lock = threading.Lock()
+        self._stats = {"lockouts": 0, "rejected": 0}
+
+    def locked_for(self, username: str) -> float:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return 0.0
+            if entry[1] <= now and now - entry[2] > self.ttl:
+                del self._entries[username]
+                return 0.0
+            remaining = max(0.0, entry[1] - now)
+            if remaining:
+                self._stats["rejected"] += 1
+            return remaining
+
+    def record_failure(self, username: str) -> float:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(username, None) or [0, 0.0, now]
+            entry[0] += 1
+            entry[2] = now
+            lockout = 0.0
+            if entry[0] >= self.threshold:
+                lockout = min(self.base * 2 ** (entry[0] - self.threshold), self.maximum)
+                entry[1] = now + lockout
+                self._stats["lockouts"] += 1
+            self._entries[username] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return lockout
+
+    def reset(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked"] = len(self._entries)
+            stats["locked"] = sum(1 for entry in self._entries.values() if entry[1] > now)
+        return stats
+
+
+_failed_attempts = FailedAttemptTracker()
+_login_seconds = REGISTRY.histogram("hms_login_seconds", "Time spent in authenticate(), by outcome.",
+                                    ("outcome",), buckets=LOGIN_LATENCY_BUCKETS)
+
+
+def get_lockout_remaining(username: str) -> float:
+    return _failed_attempts.locked_for(username)
+
+
+def get_login_stats() -> dict:
+    stats = _failed_attempts.stats()
+    stats["latency"] = {outcome: _login_seconds.snapshot(outcome=outcome) for outcome in LOGIN_OUTCOMES}
+    stats["workers"] = AUTH_WORKERS
+    return stats
+
+
 def create_default_users():
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        cur.execute("SELECT COUNT(*) AS c FROM users;")
-        count = cur.fetchone()["c"]
-
-        if count == 0:
-            users = [
-                ("admin", hash_password("admin123"), "admin"),
-                ("doctor", hash_password("doctor123"), "doctor"),
-                ("reception", hash_password("reception123"), "receptionist"),
-            ]
-            
-            cur.executemany(
-                "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?);",
-                users,
-            )
-            conn.commit()
-            print("[AUTH] Default users created successfully.")
-        else:
-            print("[AUTH] Users already exist; skipping default user creation.")
+        with get_connection() as conn:
+            cur = conn.cursor()
+
+            cur.execute("SELECT COUNT(*) AS c FROM users;")
+            count = cur.fetchone()["c"]
+
+            if count == 0:
+                users = [
+                    ("admin", hash_password("admin123"), "admin"),
+                    ("doctor", hash_password("doctor123"), "doctor"),
+                    ("reception", hash_password("reception123"), "receptionist"),
+                ]
+                
+                cur.executemany(
+                    "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?);",
+                    users,
+                )
+                conn.commit()
+                print("[AUTH] Default users created successfully.")
+            else:
+                print("[AUTH] Users already exist; skipping default user creation.")
 
-        conn.close()
+        # Pay for the unknown-user hash at startup rather than on a login.
+        _get_dummy_hash()
         
     except Exception as e:
         print(f"[AUTH ERROR] Failed to create default users: {e}")
@@ -69,39 +288,64 @@ def create_default_users():
 
 
 def authenticate(username: str, password: str) -> dict:
+    started = time.perf_counter()
+    outcome = "error"
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        cur.execute("SELECT * FROM users WHERE username = ?;", (username,))
-        row = cur.fetchone()
-
-        if not row:
-            conn.close()
-            print(f"[AUTH] Login attempt: username '{username}' not found")
+        # Locked usernames are refused before any hashing, so brute force
+        # cannot burn CPU.
+        remaining = _failed_attempts.locked_for(username)
+        if remaining:
+            outcome = "locked"
+            print(f"[AUTH] Login attempt: '{username}' locked out for another {remaining:.0f}s")
             return None
 
-        password_hash = row["password_hash"]
-        
-        if not verify_password(password, password_hash):
-            conn.close()
-            print(f"[AUTH] Login attempt: incorrect password for '{username}'")
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM users WHERE username = ?;", (username,))
+            row = cur.fetchone()
+
+        password_hash = row["password_hash"] if row else _get_dummy_hash()
+        valid = _offload(verify_password, password, password_hash)
+
+        if not row or not valid:
+            outcome = "failure"
+            lockout = _failed_attempts.record_failure(username)
+            if not row:
+                print(f"[AUTH] Login attempt: username '{username}' not found")
+            else:
+                print(f"[AUTH] Login attempt: incorrect password for '{username}'")
+                if USE_BCRYPT and BCRYPT_AVAILABLE and is_legacy_hash(password_hash):
+                    print(f"[AUTH WARNING] '{username}' still has an unconverted SHA-256 hash; "
+                          "run 'python -m backend.maintenance migrate-password-hashes'")
+            if lockout:
+                print(f"[AUTH] '{username}' locked out for {lockout:.0f}s after repeated failures")
             return None
 
+        _failed_attempts.reset(username)
+
         if USE_BCRYPT and BCRYPT_AVAILABLE:
-            if not (password_hash.startswith("$2") or password_hash.startswith("$2a$") or password_hash.startswith("$2b$")):
-                new_hash = hash_password(password)
-                cur.execute(
-                    "UPDATE users SET password_hash = ? WHERE username = ?;",
-                    (new_hash, username)
-                )
-                conn.commit()
-                print(f"[AUTH] Upgraded password hash to bcrypt for user '{username}'")
+            if password_hash.startswith(WRAPPED_HASH_PREFIX):
+                new_hash = _offload(hash_password, password)
+                with get_connection() as conn:
+                    conn.execute(
+                        "UPDATE users SET password_hash = ? WHERE username = ?;",
+                        (new_hash, username)
+                    )
+                    conn.commit()
+                print(f"[AUTH] Replaced wrapped password hash with bcrypt for user '{username}'")
 
-        conn.close()
+        outcome = "success"
         print(f"[AUTH] Login successful: {username} ({row['role']})")
         return {"username": row["username"], "role": row["role"]}
-        
+
+    except AuthBusyError as e:
+        outcome = "busy"
+        print(f"[AUTH WARNING] Login refused: {e}")
+        return None
+
     except Exception as e:
         print(f"[AUTH ERROR] Authentication failed: {e}")
         return None
+
+    finally:
+        _login_seconds.observe(time.perf_counter() - started, outcome=outcome)
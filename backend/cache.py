@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+QUERY_CACHE_MAX_ENTRIES = 256
+QUERY_CACHE_TTL = 60.0
+
+# One counter per data set. Write paths bump the scope they touched; a cached
+# result is only served while every scope it read from is unchanged.
+DATA_SCOPES = ("patients", "logs")
+
+_versions = {scope: 0 for scope in DATA_SCOPES}
+_versions_lock = threading.Lock()
+
+
+def bump_data_version(*scopes: str) -> None:
+    with _versions_lock:
+        for scope in scopes or DATA_SCOPES:
+            _versions[scope] += 1
+
+
+def get_data_version(*scopes: str) -> tuple:
+    with _versions_lock:
+        return tuple(_versions[scope] for scope in scopes)
+
+
+def cacheable(*scopes: str) -> Callable:
+    def decorate(fn):
+        fn._cache_scopes = scopes
+        return fn
+    return decorate
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl: float = QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "expired": 0, "evictions": 0}
+
+    def get_or_load(self, role: str, fn: Callable, *args, **kwargs):
+        scopes = getattr(fn, "_cache_scopes", DATA_SCOPES)
+        key = (role, fn.__module__, fn.__qualname__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable arguments (lists, dicts) cannot be cache keys.
+            return fn(*args, **kwargs)
+
+        version = get_data_version(*scopes)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, entry_version, expires_at = entry
+                if entry_version == version and expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["stale" if entry_version != version else "expired"] += 1
+            self._stats["misses"] += 1
+
+        value = fn(*args, **kwargs)
+
+        # Tag with the version read *before* loading: a write that lands
+        # mid-query makes this entry stale on the next lookup.
+        with self._lock:
+            self._entries[key] = (value, version, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_query_cache = QueryCache()
+
+
+def cached_read(role: str, fn: Callable, *args, **kwargs):
+    return _query_cache.get_or_load(role, fn, *args, **kwargs)
+
+
+def clear_query_cache() -> None:
+    _query_cache.clear()
+
+
+def get_query_cache_stats() -> dict:
+    return _query_cache.stats()
@@ -1,9 +1,33 @@
 import os
-from cryptography.fernet import Fernet
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional
+from cryptography.fernet import Fernet, MultiFernet
+from .cache import bump_data_version
 from .db import get_connection
+from .metrics import REGISTRY
 
 
 ENCRYPTION_KEY_FILE = os.path.join(os.path.dirname(__file__), "..", "data", ".key")
+KEY_CHECK_INTERVAL = 1.0
+
+ANONYMIZE_CHUNK_SIZE = 1000
+ANONYMIZE_WORKERS = min(8, os.cpu_count() or 1)
+
+DECRYPT_CACHE_MAX_ENTRIES = 5000
+DECRYPT_CACHE_TTL = 300.0
+
+# Counted per process: anonymize_all_patients(use_processes=True) calls
+# made in its worker processes are not included.
+_crypto_operations = REGISTRY.counter("hms_crypto_operations_total", "Fernet encrypt/decrypt calls.",
+                                      ("op", "outcome"))
+
+_key_ring_lock = threading.Lock()
+_key_ring = {"cipher": None, "mtime_ns": None, "checked_at": 0.0}
 
 
 def get_or_create_encryption_key() -> bytes:
@@ -14,9 +38,20 @@ def get_or_create_encryption_key() -> bytes:
             with open(ENCRYPTION_KEY_FILE, "rb") as f:
                 return f.read()
         else:
+            # Written to a temp file and linked into place, so a concurrent
+            # reader never sees a partial key and two creators cannot both
+            # win: the loser reads the key that was kept.
             key = Fernet.generate_key()
-            with open(ENCRYPTION_KEY_FILE, "wb") as f:
-                f.write(key)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(ENCRYPTION_KEY_FILE), prefix=".key.")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(key)
+                os.link(tmp_path, ENCRYPTION_KEY_FILE)
+            except FileExistsError:
+                with open(ENCRYPTION_KEY_FILE, "rb") as f:
+                    return f.read()
+            finally:
+                os.remove(tmp_path)
             print("[PRIVACY] Encryption key generated and stored.")
             return key
     except Exception as e:
@@ -24,16 +59,56 @@ def get_or_create_encryption_key() -> bytes:
         raise
 
 
+def _load_key_ring() -> MultiFernet:
+    # One key per line; the first encrypts, every key can decrypt, so a
+    # rotation is done by prepending a new key to the file.
+    keys = [line.strip() for line in get_or_create_encryption_key().splitlines() if line.strip()]
+    if not keys:
+        raise ValueError(f"No encryption keys found in {ENCRYPTION_KEY_FILE}")
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def get_cipher() -> MultiFernet:
+    now = time.monotonic()
+    cipher = _key_ring["cipher"]
+    if cipher is not None and now - _key_ring["checked_at"] < KEY_CHECK_INTERVAL:
+        return cipher
+
+    with _key_ring_lock:
+        if _key_ring["cipher"] is not None and now - _key_ring["checked_at"] < KEY_CHECK_INTERVAL:
+            return _key_ring["cipher"]
+
+        try:
+            mtime_ns = os.stat(ENCRYPTION_KEY_FILE).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        if _key_ring["cipher"] is None or mtime_ns is None or mtime_ns != _key_ring["mtime_ns"]:
+            _key_ring["cipher"] = _load_key_ring()
+            _key_ring["mtime_ns"] = os.stat(ENCRYPTION_KEY_FILE).st_mtime_ns
+            print("[PRIVACY] Encryption key ring loaded.")
+
+        _key_ring["checked_at"] = now
+        return _key_ring["cipher"]
+
+
+def reset_key_ring() -> None:
+    with _key_ring_lock:
+        _key_ring["cipher"] = None
+        _key_ring["mtime_ns"] = None
+        _key_ring["checked_at"] = 0.0
+
+
 def encrypt_data(plaintext: str) -> str:
     try:
         if not plaintext:
             return None
         
-        key = get_or_create_encryption_key()
-        cipher_suite = Fernet(key)
-        encrypted = cipher_suite.encrypt(plaintext.encode("utf-8"))
+        encrypted = get_cipher().encrypt(plaintext.encode("utf-8"))
+        _crypto_operations.inc(op="encrypt", outcome="ok")
         return encrypted.decode("utf-8")
     except Exception as e:
+        _crypto_operations.inc(op="encrypt", outcome="error")
         print(f"[PRIVACY ERROR] Encryption failed: {e}")
         return None
 
@@ -43,15 +118,82 @@ def decrypt_data(encrypted_text: str) -> str:
         if not encrypted_text:
             return None
         
-        key = get_or_create_encryption_key()
-        cipher_suite = Fernet(key)
-        decrypted = cipher_suite.decrypt(encrypted_text.encode("utf-8"))
+        decrypted = get_cipher().decrypt(encrypted_text.encode("utf-8"))
+        _crypto_operations.inc(op="decrypt", outcome="ok")
         return decrypted.decode("utf-8")
     except Exception as e:
+        _crypto_operations.inc(op="decrypt", outcome="error")
         print(f"[PRIVACY ERROR] Decryption failed: {e}")
         return None
 
 
+class DecryptionCache:
+    # Plaintext PII lives here, so it is bounded in size and age and is
+    # purged explicitly on logout.
+    def __init__(self, max_entries: int = DECRYPT_CACHE_MAX_ENTRIES, ttl: float = DECRYPT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "purges": 0}
+
+    def get(self, token: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                plaintext, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(token)
+                    self._stats["hits"] += 1
+                    return plaintext
+                del self._entries[token]
+                self._stats["expirations"] += 1
+
+        plaintext = decrypt_data(token)
+        with self._lock:
+            self._stats["misses"] += 1
+            if plaintext is not None:
+                self._entries[token] = (plaintext, now + self.ttl)
+                self._entries.move_to_end(token)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+        return plaintext
+
+    def purge(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats["purges"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_decryption_cache = DecryptionCache()
+
+
+def decrypt_data_cached(encrypted_text: str) -> str:
+    if not encrypted_text:
+        return None
+    return _decryption_cache.get(encrypted_text)
+
+
+def purge_decryption_cache() -> None:
+    _decryption_cache.purge()
+    print("[PRIVACY] Decryption cache purged.")
+
+
+def get_decryption_cache_stats() -> dict:
+    return _decryption_cache.stats()
+
+
 def anonymize_name(real_name: str, patient_id: int) -> str:
     try:
         if not real_name:
@@ -72,68 +214,196 @@ def anonymize_contact(contact: str) -> str:
         return None
 
 
-def anonymize_all_patients():
+def _anonymize_rows(rows: list) -> list:
+    return [
+        (
+            anonymize_name(name, patient_id),
+            anonymize_contact(contact),
+            encrypt_data(name),
+            encrypt_data(contact),
+            patient_id,
+            name,
+            contact,
+        )
+        for patient_id, name, contact in rows
+    ]
+
+
+def _init_anonymize_worker(key_file: str) -> None:
+    # Spawned processes re-import this module and would otherwise fall back
+    # to the default key path.
+    global ENCRYPTION_KEY_FILE
+    ENCRYPTION_KEY_FILE = key_file
+
+
+_anonymize_lock = threading.Lock()
+
+
+def _start_or_resume_run(conn) -> tuple:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, last_id, processed FROM anonymization_runs WHERE status = 'running' ORDER BY id DESC LIMIT 1;"
+    )
+    row = cur.fetchone()
+    if row:
+        print(f"[PRIVACY] Resuming anonymization run {row['id']} after patient id {row['last_id']}.")
+        return row["id"], row["last_id"], row["processed"]
+
+    cur.execute(
+        "INSERT INTO anonymization_runs (status, started_at) VALUES ('running', ?);",
+        (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),),
+    )
+    conn.commit()
+    return cur.lastrowid, 0, 0
+
+
+def _finish_run(conn, run_id: int, status: str) -> None:
+    conn.execute(
+        "UPDATE anonymization_runs SET status = ?, finished_at = ? WHERE id = ?;",
+        (status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run_id),
+    )
+    conn.commit()
+
+
+def anonymize_all_patients(chunk_size: int = ANONYMIZE_CHUNK_SIZE, workers: int = ANONYMIZE_WORKERS,
+                           use_processes: bool = False, full: bool = False,
+                           progress_callback: Optional[Callable[[int, int], None]] = None) -> dict:
+    if not _anonymize_lock.acquire(blocking=False):
+        raise RuntimeError("Anonymization is already running in this process.")
+
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        started = time.perf_counter()
+        with get_connection() as conn:
+            if full:
+                # e.g. after a key rotation: re-encrypt every row.
+                conn.execute("UPDATE patients SET anonymization_dirty = 1;")
+                conn.commit()
 
-        cur.execute("SELECT id, name, contact FROM patients;")
-        rows = cur.fetchall()
+            run_id, last_id, processed_count = _start_or_resume_run(conn)
+            resumed_from = last_id
 
-        processed_count = 0
-        for row in rows:
-            anon_name = anonymize_name(row["name"], row["id"])
-            anon_contact = anonymize_contact(row["contact"])
-            enc_name = encrypt_data(row["name"])
-            enc_contact = encrypt_data(row["contact"])
-            
-            cur.execute(
-                """
-                UPDATE patients
-                SET anonymized_name = ?, anonymized_contact = ?, encrypted_name = ?, encrypted_contact = ?
-                WHERE id = ?;
-                """,
-                (anon_name, anon_contact, enc_name, enc_contact, row["id"]),
-            )
-            processed_count += 1
+            # Only rows flagged by insert or by trg_patients_mark_dirty are
+            # read, so a run costs what changed, not the table size.
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM patients WHERE anonymization_dirty = 1 AND id > ?;", (last_id,))
+            total = processed_count + cur.fetchone()[0]
+
+            if use_processes:
+                # Create (or load) the key here, so workers only ever read an
+                # existing, complete key file.
+                get_cipher()
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_anonymize_worker,
+                                               initargs=(ENCRYPTION_KEY_FILE,))
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers)
+
+            with executor:
+                in_flight = deque()
+                read_cursor = last_id
+                exhausted = False
+
+                while in_flight or not exhausted:
+                    # Keep a bounded number of chunks in flight so memory
+                    # stays flat no matter how big the table is.
+                    while not exhausted and len(in_flight) < workers * 2:
+                        cur.execute(
+                            """
+                            SELECT id, name, contact FROM patients
+                            WHERE anonymization_dirty = 1 AND id > ?
+                            ORDER BY id LIMIT ?;
+                            """,
+                            (read_cursor, chunk_size),
+                        )
+                        rows = [tuple(r) for r in cur.fetchall()]
+                        if not rows:
+                            exhausted = True
+                            break
+                        read_cursor = rows[-1][0]
+                        in_flight.append((read_cursor, executor.submit(_anonymize_rows, rows)))
+
+                    if not in_flight:
+                        break
 
-        conn.commit()
-        conn.close()
-        print(f"[PRIVACY] Anonymization and encryption completed: {processed_count} patients processed.")
+                    chunk_last_id, future = in_flight.popleft()
+                    updates = future.result()
+
+                    # One short transaction per chunk; the run's checkpoint
+                    # commits with the rows so a crash resumes exactly here.
+                    # Rows edited since the chunk was read no longer match
+                    # and stay dirty for the next run, rather than getting
+                    # values built from the old name/contact.
+                    cur.executemany(
+                        """
+                        UPDATE patients
+                        SET anonymized_name = ?, anonymized_contact = ?, encrypted_name = ?, encrypted_contact = ?,
+                            anonymization_dirty = 0
+                        WHERE id = ? AND name IS ? AND contact IS ?;
+                        """,
+                        updates,
+                    )
+                    processed_count += max(cur.rowcount, 0)
+                    cur.execute(
+                        "UPDATE anonymization_runs SET last_id = ?, processed = ? WHERE id = ?;",
+                        (chunk_last_id, processed_count, run_id),
+                    )
+                    conn.commit()
+                    bump_data_version("patients")
+
+                    if progress_callback:
+                        progress_callback(processed_count, total)
+                    print(f"[PRIVACY] Anonymization progress: {processed_count}/{total} patients.")
+
+            _finish_run(conn, run_id, "completed")
+
+        elapsed = time.perf_counter() - started
+        print(f"[PRIVACY] Anonymization and encryption completed: {processed_count} patients processed in {elapsed:.2f}s.")
+        return {
+            "run_id": run_id,
+            "processed": processed_count,
+            "resumed_from": resumed_from,
+            "elapsed": elapsed,
+        }
         
     except Exception as e:
         print(f"[PRIVACY ERROR] Batch anonymization failed: {e}")
         raise
+    finally:
+        _anonymize_lock.release()
 
 
 def anonymize_single_patient(patient_id: int):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        cur.execute("SELECT id, name, contact FROM patients WHERE id = ?;", (patient_id,))
-        row = cur.fetchone()
-
-        if not row:
-            print(f"[PRIVACY] Patient {patient_id} not found.")
-            return False
-
-        anon_name = anonymize_name(row["name"], row["id"])
-        anon_contact = anonymize_contact(row["contact"])
-        enc_name = encrypt_data(row["name"])
-        enc_contact = encrypt_data(row["contact"])
-
-        cur.execute(
-            """
-            UPDATE patients
-            SET anonymized_name = ?, anonymized_contact = ?, encrypted_name = ?, encrypted_contact = ?
-            WHERE id = ?;
-            """,
-            (anon_name, anon_contact, enc_name, enc_contact, patient_id),
-        )
+        with get_connection() as conn:
+            cur = conn.cursor()
+
+            cur.execute("SELECT id, name, contact FROM patients WHERE id = ?;", (patient_id,))
+            row = cur.fetchone()
+
+            if not row:
+                print(f"[PRIVACY] Patient {patient_id} not found.")
+                return False
+
+            anon_name = anonymize_name(row["name"], row["id"])
+            anon_contact = anonymize_contact(row["contact"])
+            enc_name = encrypt_data(row["name"])
+            enc_contact = encrypt_data(row["contact"])
+
+            cur.execute(
+                """
+                UPDATE patients
+                SET anonymized_name = ?, anonymized_contact = ?, encrypted_name = ?, encrypted_contact = ?,
+                    anonymization_dirty = 0
+                WHERE id = ? AND name IS ? AND contact IS ?;
+                """,
+                (anon_name, anon_contact, enc_name, enc_contact, patient_id, row["name"], row["contact"]),
+            )
+            if not cur.rowcount:
+                conn.rollback()
+                print(f"[PRIVACY] Patient {patient_id} changed during anonymization; left for the next run.")
+                return False
 
-        conn.commit()
-        conn.close()
+            conn.commit()
+        bump_data_version("patients")
         print(f"[PRIVACY] Patient {patient_id} anonymized and encrypted successfully.")
         return True
 
@@ -1,13 +1,76 @@
 import sqlite3
+import gzip
+import hashlib
+import json
+import lzma
 import os
 import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional
+
+from .cache import bump_data_version
+from .metrics import REGISTRY
+from .migrations import apply_migrations, get_schema_version
+from .sql_trace import TracingConnection
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "data", "hospital.db"))
 DB_BACKUP_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "data", "backups"))
 
+# SQLite's default. The WAL archiver sets this to 0 so that only it
+# checkpoints and no frame is recycled before it has been archived.
+WAL_AUTOCHECKPOINT = 1000
+
+POOL_MAX_SIZE = 8
+POOL_TIMEOUT = 10.0
+BUSY_TIMEOUT = 5
+
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.005
+BACKUP_MAX_RESTARTS = 3
+BACKUP_COMPRESSION = None  # None, "gzip" or "lzma"
+BACKUP_SUFFIXES = {None: ".db", "gzip": ".db.gz", "lzma": ".db.xz"}
+_BACKUP_OPENERS = {".db.gz": gzip.open, ".db.xz": lzma.open}
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_last_backup_stats = {}
+
+BACKUP_DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+_backup_seconds = REGISTRY.histogram("hms_backup_duration_seconds", "Time taken by successful backups.",
+                                     ("kind",), buckets=BACKUP_DURATION_BUCKETS)
+_backup_failures = REGISTRY.counter("hms_backup_failures_total", "Backups that raised an error.", ("kind",))
+_backup_last_success = REGISTRY.gauge("hms_backup_last_success_timestamp_seconds",
+                                      "Unix time of the last successful backup.", ("kind",))
+_connections_opened = REGISTRY.counter("hms_db_connections_opened_total", "SQLite connections opened by the pool.")
+_connections = REGISTRY.gauge("hms_db_connections", "Pooled SQLite connections by state.", ("state",))
+
+# Free pages handed back to the OS per incremental_vacuum transaction.
+VACUUM_PAGES_PER_STEP = 1000
+VACUUM_STEP_PAUSE = 0.01
+
+# Every backup is recorded in the catalog, so listing, restore and retention
+# never walk the backup directory.
+BACKUP_CATALOG_NAME = "catalog.json"
+BACKUP_COUNTED_TABLES = ("patients", "logs", "users")
+# Grandfather-father-son: the newest backup of each of the last N days,
+# ISO weeks and months is kept, plus the `recent` newest overall.
+BACKUP_RETENTION = {"recent": 3, "daily": 7, "weekly": 4, "monthly": 12}
+
+_catalog_lock = threading.RLock()
+
+# Applied once when a pooled connection is opened, never per checkout.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA cache_size=-20000;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA temp_store=MEMORY;",
+)
+
 
 def ensure_backup_directory():
     try:
@@ -16,7 +79,219 @@ def ensure_backup_directory():
         print(f"[DB WARNING] Could not create backup directory: {e}")
 
 
-def create_database_backup():
+def _is_backup_file(file: str) -> bool:
+    return file.startswith("hospital_db_") and file.endswith(tuple(BACKUP_SUFFIXES.values()))
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _catalog_path() -> str:
+    return os.path.join(DB_BACKUP_DIR, BACKUP_CATALOG_NAME)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scan_backup_directory() -> list:
+    # One-off import of backups made before the catalog existed.
+    entries = []
+    if not os.path.isdir(DB_BACKUP_DIR):
+        return entries
+    for file in os.listdir(DB_BACKUP_DIR):
+        path = os.path.join(DB_BACKUP_DIR, file)
+        if not _is_backup_file(file) or not os.path.isfile(path):
+            continue
+        try:
+            created_at = datetime.strptime(file[len("hospital_db_"):len("hospital_db_") + 15], "%Y%m%d_%H%M%S")
+        except ValueError:
+            created_at = datetime.fromtimestamp(os.path.getmtime(path))
+        entries.append({
+            "kind": "full",
+            "file": file,
+            "size": os.path.getsize(path),
+            "sha256": file_sha256(path),
+            "row_counts": None,
+            "compression": next((c for c, suffix in BACKUP_SUFFIXES.items() if c and file.endswith(suffix)), None),
+            "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    return entries
+
+
+def _load_catalog() -> list:
+    with _catalog_lock:
+        path = _catalog_path()
+        if not os.path.exists(path):
+            entries = _scan_backup_directory()
+            if entries:
+                _save_catalog(entries)
+            return entries
+        with open(path) as f:
+            return json.load(f)["backups"]
+
+
+def _save_catalog(entries: list) -> None:
+    with _catalog_lock:
+        ensure_backup_directory()
+        tmp_path = _catalog_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"backups": entries}, f, indent=2)
+        os.replace(tmp_path, _catalog_path())
+
+
+def register_backup(entry: dict) -> None:
+    with _catalog_lock:
+        entries = [e for e in _load_catalog() if e["file"] != entry["file"]]
+        entries.append(entry)
+        _save_catalog(entries)
+
+
+def unregister_backup(file: str) -> None:
+    with _catalog_lock:
+        _save_catalog([e for e in _load_catalog() if e["file"] != file])
+
+
+def list_backups(kind: Optional[str] = "full") -> list:
+    # Newest first; `file` is relative to DB_BACKUP_DIR.
+    entries = [e for e in _load_catalog() if kind is None or e["kind"] == kind]
+    return sorted(entries, key=lambda e: e["created_at"], reverse=True)
+
+
+def find_backup(file: str) -> Optional[dict]:
+    return next((e for e in _load_catalog() if e["file"] == file), None)
+
+
+def select_retained_backups(entries: list, policy: dict) -> set:
+    ordered = sorted(entries, key=lambda e: e["created_at"], reverse=True)
+    keep = {e["file"] for e in ordered[:policy.get("recent", 0)]}
+
+    tiers = (
+        ("daily", lambda d: d.date()),
+        ("weekly", lambda d: d.isocalendar()[:2]),
+        ("monthly", lambda d: (d.year, d.month)),
+    )
+    for tier, bucket_of in tiers:
+        limit = policy.get(tier, 0)
+        buckets = set()
+        for entry in ordered:
+            bucket = bucket_of(datetime.strptime(entry["created_at"], "%Y-%m-%d %H:%M:%S"))
+            if bucket in buckets:
+                continue
+            if len(buckets) >= limit:
+                break
+            buckets.add(bucket)
+            keep.add(entry["file"])
+    return keep
+
+
+def apply_retention_policy(policy: Optional[dict] = None) -> list:
+    policy = BACKUP_RETENTION if policy is None else policy
+    with _catalog_lock:
+        entries = list_backups("full")
+        keep = select_retained_backups(entries, policy)
+        deleted = []
+        for entry in entries:
+            if entry["file"] in keep:
+                continue
+            try:
+                path = os.path.join(DB_BACKUP_DIR, entry["file"])
+                if os.path.exists(path):
+                    os.remove(path)
+                unregister_backup(entry["file"])
+                deleted.append(entry["file"])
+                print(f"[DB] Deleted backup outside retention policy: {entry['file']}")
+            except OSError as e:
+                print(f"[DB WARNING] Could not delete old backup {entry['file']}: {e}")
+        return deleted
+
+
+def _row_counts(conn: sqlite3.Connection) -> dict:
+    counts = {}
+    for table in BACKUP_COUNTED_TABLES:
+        try:
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0]
+        except sqlite3.OperationalError:
+            counts[table] = None
+    return counts
+
+
+def online_backup(dest_path: str) -> dict:
+    # The backup API copies a consistent snapshot (WAL included) a few pages
+    # at a time, releasing the source lock between steps so readers and
+    # writers keep going.
+    started = time.perf_counter()
+    progress = {"remaining": None, "restarts": 0}
+
+    def on_progress(status, remaining, total):
+        # Every commit from another connection restarts a stepped backup;
+        # under steady write traffic it would never finish.
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            progress["restarts"] += 1
+            if progress["restarts"] > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        progress["remaining"] = remaining
+
+    dest = sqlite3.connect(dest_path)
+    try:
+        with get_connection() as conn:
+            try:
+                conn.backup(dest, pages=BACKUP_PAGES_PER_STEP, progress=on_progress, sleep=BACKUP_STEP_SLEEP)
+                mode = "stepped"
+            except _BackupRestarted:
+                # One step holds a single read snapshot; in WAL mode that
+                # does not block writers.
+                conn.backup(dest, pages=-1)
+                mode = "single_step"
+
+        page_size = dest.execute("PRAGMA page_size;").fetchone()[0]
+        page_count = dest.execute("PRAGMA page_count;").fetchone()[0]
+        check = dest.execute("PRAGMA quick_check;").fetchone()[0]
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"Backup failed quick_check: {check}")
+        row_counts = _row_counts(dest)
+        # A standalone backup file should not need a -wal sidecar.
+        dest.execute("PRAGMA journal_mode=DELETE;")
+    finally:
+        dest.close()
+
+    elapsed = time.perf_counter() - started
+    bytes_copied = page_size * page_count
+    return {
+        "mode": mode,
+        "restarts": progress["restarts"],
+        "bytes_copied": bytes_copied,
+        "seconds": elapsed,
+        "bytes_per_second": bytes_copied / elapsed if elapsed else 0.0,
+        "row_counts": row_counts,
+    }
+
+
+def copy_stream(src_path: str, dest_path: str, src_opener=open, dest_opener=open) -> None:
+    with src_opener(src_path, "rb") as src, dest_opener(dest_path, "wb") as dest:
+        shutil.copyfileobj(src, dest, COPY_CHUNK_SIZE)
+
+
+def get_last_backup_stats() -> dict:
+    return dict(_last_backup_stats)
+
+
+def record_backup_duration(kind: str, seconds: float) -> None:
+    _backup_seconds.observe(seconds, kind=kind)
+    _backup_last_success.set(time.time(), kind=kind)
+
+
+def record_backup_failure(kind: str) -> None:
+    _backup_failures.inc(kind=kind)
+
+
+def create_database_backup(compression: Optional[str] = BACKUP_COMPRESSION):
+    started = time.perf_counter()
     try:
         ensure_backup_directory()
         
@@ -24,61 +299,103 @@ def create_database_backup():
             print("[DB] No database file to backup.")
             return None
         
-        existing_backups = []
-        if os.path.exists(DB_BACKUP_DIR):
-            for file in os.listdir(DB_BACKUP_DIR):
-                if file.startswith("hospital_db_") and file.endswith(".db"):
-                    file_path = os.path.join(DB_BACKUP_DIR, file)
-                    if os.path.isfile(file_path):
-                        existing_backups.append(file_path)
+        if compression not in BACKUP_SUFFIXES:
+            raise ValueError(f"Unknown backup compression: {compression}")
         
-        existing_backups.sort(reverse=True)
+        created_at = datetime.now()
+        timestamp = created_at.strftime("%Y%m%d_%H%M%S")
+        backup_path = os.path.join(DB_BACKUP_DIR, f"hospital_db_{timestamp}{BACKUP_SUFFIXES[compression]}")
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = os.path.join(DB_BACKUP_DIR, f"hospital_db_{timestamp}.db")
-        
-        shutil.copy2(DB_PATH, backup_path)
-        print(f"[DB] Database backed up to: {backup_path}")
-        
-        all_backups = []
-        if os.path.exists(DB_BACKUP_DIR):
-            for file in os.listdir(DB_BACKUP_DIR):
-                if file.startswith("hospital_db_") and file.endswith(".db"):
-                    file_path = os.path.join(DB_BACKUP_DIR, file)
-                    if os.path.isfile(file_path):
-                        all_backups.append(file_path)
-        
-        all_backups.sort()
+        # Write to a temp name first so a failed or partial backup never
+        # shows up as a restorable file.
+        tmp_path = os.path.join(DB_BACKUP_DIR, f".hospital_db_{timestamp}.tmp")
+        try:
+            stats = online_backup(tmp_path)
+            if compression:
+                copy_stream(tmp_path, backup_path, dest_opener=_BACKUP_OPENERS[BACKUP_SUFFIXES[compression]])
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, backup_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         
-        MAX_BACKUPS = 5
+        stats["path"] = backup_path
+        stats["file_size"] = os.path.getsize(backup_path)
+        stats["compression"] = compression
+        _last_backup_stats.clear()
+        _last_backup_stats.update(stats)
+        print(
+            f"[DB] Database backed up to: {backup_path} "
+            f"({stats['bytes_copied'] / 1024 / 1024:.1f} MiB at "
+            f"{stats['bytes_per_second'] / 1024 / 1024:.1f} MiB/s, {stats['file_size']} bytes on disk)"
+        )
         
-        if len(all_backups) > MAX_BACKUPS:
-            backups_to_delete = all_backups[:-MAX_BACKUPS]
-            for old_backup in backups_to_delete:
-                try:
-                    os.remove(old_backup)
-                    print(f"[DB] Deleted old backup (limit exceeded): {os.path.basename(old_backup)}")
-                except Exception as e:
-                    print(f"[DB WARNING] Could not delete old backup {old_backup}: {e}")
+        register_backup({
+            "kind": "full",
+            "file": os.path.basename(backup_path),
+            "size": stats["file_size"],
+            "sha256": file_sha256(backup_path),
+            "row_counts": stats["row_counts"],
+            "compression": compression,
+            "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        apply_retention_policy()
+        record_backup_duration("full", time.perf_counter() - started)
         
         return backup_path
         
     except Exception as e:
+        record_backup_failure("full")
         print(f"[DB ERROR] Backup failed: {e}")
         return None
 
 
+def restore_database_file(source_path: str) -> bool:
+    source = sqlite3.connect(source_path)
+    try:
+        check = source.execute("PRAGMA quick_check;").fetchone()[0]
+        if check != "ok":
+            print(f"[DB ERROR] Backup failed integrity check: {check}")
+            return False
+        # Copy into the live database through SQLite so pooled
+        # connections and the WAL stay consistent.
+        with get_connection() as conn:
+            source.backup(conn)
+    finally:
+        source.close()
+    
+    # Older backups may predate the current schema.
+    with get_connection() as conn:
+        apply_migrations(conn)
+    bump_data_version()
+    return True
+
+
 def restore_from_backup(backup_path: str) -> bool:
     try:
         if not os.path.exists(backup_path):
             print(f"[DB ERROR] Backup file not found: {backup_path}")
             return False
         
+        entry = find_backup(os.path.relpath(backup_path, DB_BACKUP_DIR))
+        if entry and entry.get("sha256") and file_sha256(backup_path) != entry["sha256"]:
+            print(f"[DB ERROR] Backup checksum does not match the catalog: {backup_path}")
+            return False
+        
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
         
-        shutil.copy2(backup_path, DB_PATH)
-        print(f"[DB] Database restored from: {backup_path}")
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(DB_PATH)) as tmp_dir:
+            source_path = backup_path
+            opener = next((o for suffix, o in _BACKUP_OPENERS.items() if backup_path.endswith(suffix)), None)
+            if opener:
+                source_path = os.path.join(tmp_dir, "restore.db")
+                copy_stream(backup_path, source_path, src_opener=opener)
+            
+            if not restore_database_file(source_path):
+                return False
         
+        print(f"[DB] Database restored from: {backup_path}")
         return True
         
     except Exception as e:
@@ -96,14 +413,11 @@ def check_database_availability() -> bool:
             print("[DB ERROR] Database file exists but is not readable.")
             return False
         
-        conn = sqlite3.connect(DB_PATH, timeout=5)
-        cur = conn.cursor()
-        
         required_tables = ["users", "patients", "logs"]
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        existing_tables = [row[0] for row in cur.fetchall()]
-        
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            existing_tables = [row[0] for row in cur.fetchall()]
         
         missing_tables = [t for t in required_tables if t not in existing_tables]
         if missing_tables:
@@ -121,19 +435,31 @@ def check_database_availability() -> bool:
         return False
 
 
-def get_connection() -> sqlite3.Connection:
+def _open_connection(db_path: str) -> sqlite3.Connection:
     try:
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=5)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        # TracingConnection times every statement for the diagnostics page.
+        conn = sqlite3.connect(db_path, check_same_thread=False, timeout=BUSY_TIMEOUT,
+                               factory=TracingConnection)
         conn.row_factory = sqlite3.Row
-        
-        print(f"[DB] Connected to database: {DB_PATH}")
+        # auto_vacuum only takes effect on a new, empty database (existing
+        # files are converted with enable_incremental_vacuum()). Setting it
+        # on an existing file wants the write lock, so a connection opened
+        # while another holds it, e.g. for the WAL archiver's checkpoint,
+        # would fail with "database is locked".
+        if conn.execute("PRAGMA page_count;").fetchone()[0] == 0:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA wal_autocheckpoint={int(WAL_AUTOCHECKPOINT)};")
+        _connections_opened.inc()
+
         return conn
-        
+
     except sqlite3.OperationalError as e:
         print(f"[DB ERROR] Cannot open database file: {e}")
-        print(f"[DB ERROR] Database path: {DB_PATH}")
+        print(f"[DB ERROR] Database path: {db_path}")
         raise
     except sqlite3.Error as e:
         print(f"[DB ERROR] Connection failed: {e}")
@@ -143,71 +469,204 @@ def get_connection() -> sqlite3.Connection:
         raise
 
 
-def init_db() -> None:
-    try:
-        ensure_backup_directory()
-        
-        conn = get_connection()
-        cur = conn.cursor()
-
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('admin','doctor','receptionist')),
-                gdpr_consent INTEGER DEFAULT 0
-            );
-            """
-        )
-        
+class ConnectionPool:
+    def __init__(self, db_path: str, max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "wait_time": 0.0, "timeouts": 0}
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._cond:
+            if self._idle:
+                self._stats["hits"] += 1
+                return self._idle.pop()
+
+            if self._open >= self.max_size:
+                self._stats["waits"] += 1
+                started = time.perf_counter()
+                deadline = started + self.timeout
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        self._stats["wait_time"] += time.perf_counter() - started
+                        raise sqlite3.OperationalError("Connection pool exhausted")
+                    self._cond.wait(remaining)
+                self._stats["wait_time"] += time.perf_counter() - started
+                if self._idle:
+                    self._stats["hits"] += 1
+                    return self._idle.pop()
+
+            self._stats["misses"] += 1
+            self._open += 1
+
         try:
-            cur.execute("ALTER TABLE users ADD COLUMN gdpr_consent INTEGER DEFAULT 0;")
-        except sqlite3.OperationalError:
-            pass
+            return _open_connection(self.db_path)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False) -> None:
+        if not discard and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._open -= 1
+                self._cond.notify()
+            else:
+                self._idle.append(conn)
+                self._cond.notify()
+                return
 
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS patients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                contact TEXT,
-                diagnosis TEXT,
-                anonymized_name TEXT,
-                anonymized_contact TEXT,
-                encrypted_name TEXT,
-                encrypted_contact TEXT,
-                created_at TEXT
-            );
-            """
-        )
-        
         try:
-            cur.execute("ALTER TABLE patients ADD COLUMN encrypted_name TEXT;")
-        except sqlite3.OperationalError:
+            conn.close()
+        except sqlite3.Error:
             pass
-        
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        discard = False
         try:
-            cur.execute("ALTER TABLE patients ADD COLUMN encrypted_contact TEXT;")
-        except sqlite3.OperationalError:
-            pass
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
 
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT,
-                role TEXT,
-                action TEXT,
-                details TEXT,
-                created_at TEXT
-            );
-            """
-        )
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["open"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+            stats["max_size"] = self.max_size
+        checkouts = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / checkouts if checkouts else 0.0
+        return stats
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        # DB_PATH may be repointed (tests, restore); never hand out stale handles.
+        if _pool is None or _pool.db_path != DB_PATH:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_pool_stats() -> dict:
+    return get_pool().stats()
+
+
+def _collect_pool_metrics() -> None:
+    with _pool_lock:
+        pool = _pool
+    # Read without get_pool(): a scrape must not open a pool of its own.
+    stats = pool.stats() if pool is not None else {}
+    for state in ("open", "idle", "in_use"):
+        _connections.set(stats.get(state, 0), state=state)
+
+
+REGISTRY.add_collector(_collect_pool_metrics)
 
-        conn.commit()
-        conn.close()
+
+def get_connection():
+    return get_pool().connection()
+
+
+def get_auto_vacuum_mode() -> str:
+    with get_connection() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+    return {0: "none", 1: "full", 2: "incremental"}.get(mode, str(mode))
+
+
+def enable_incremental_vacuum() -> None:
+    # Switching an existing database needs a full VACUUM, which rewrites the
+    # whole file; run it from maintenance, not from a request.
+    with get_connection() as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("VACUUM;")
+    print(f"[DB] auto_vacuum is now {get_auto_vacuum_mode()}.")
+
+
+def incremental_vacuum(pages_per_step: int = VACUUM_PAGES_PER_STEP) -> Optional[dict]:
+    started = time.perf_counter()
+    pages_freed = 0
+    max_lock_hold = 0.0
+    with get_connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            return None
+        while True:
+            free = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+            if not free:
+                break
+            hold_started = time.perf_counter()
+            # execute() would step the pragma once and free a single page;
+            # executescript runs it to completion.
+            conn.executescript(f"BEGIN IMMEDIATE; PRAGMA incremental_vacuum({int(pages_per_step)}); COMMIT;")
+            max_lock_hold = max(max_lock_hold, time.perf_counter() - hold_started)
+            remaining = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+            if remaining >= free:
+                break
+            pages_freed += free - remaining
+            time.sleep(VACUUM_STEP_PAUSE)
+    return {"pages_freed": pages_freed, "max_lock_hold": max_lock_hold, "seconds": time.perf_counter() - started}
+
+
+def init_db() -> None:
+    try:
+        ensure_backup_directory()
+        
+        with get_connection() as conn:
+            applied = apply_migrations(conn)
+            version = get_schema_version(conn)
+        
+        if applied:
+            print(f"[DB] Schema migrated to version {version} ({len(applied)} step(s) applied).")
+        else:
+            print(f"[DB] Schema up to date at version {version}.")
         
         if check_database_availability():
             print("[DB] Database initialization completed successfully.")
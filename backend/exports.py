@@ -0,0 +1,134 @@
+import csv
+import io
+import os
+import zlib
+from typing import Iterable, Iterator, Optional, Sequence
+
+from .db import get_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+EXPORT_FETCH_SIZE = 1000
+# Encoded CSV is handed on in pieces of about this size.
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+PARQUET_ROW_GROUP_SIZE = 100_000
+PARQUET_COMPRESSION = "zstd"
+
+
+def iter_query_rows(sql: str, params: Sequence = (), fetch_size: int = EXPORT_FETCH_SIZE,
+                    include_header: bool = True) -> Iterator[tuple]:
+    # Yields the column names first (unless include_header is off), then
+    # rows; only one fetchmany batch is held at a time.
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        if include_header:
+            yield tuple(d[0] for d in cur.description)
+        while True:
+            batch = cur.fetchmany(fetch_size)
+            if not batch:
+                break
+            for row in batch:
+                yield tuple(row)
+
+
+def iter_csv(rows: Iterable[Sequence], header: Optional[Sequence[str]] = None) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header is not None:
+        writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_query_csv(sql: str, params: Sequence = (), header: Optional[Sequence[str]] = None,
+                   compress: bool = False) -> Iterator[bytes]:
+    # A generator, so nothing touches the database until the first chunk
+    # is requested.
+    rows = iter_query_rows(sql, params)
+    columns = next(rows)
+    chunks = iter_csv(rows, header or columns)
+    yield from (iter_gzip(chunks) if compress else chunks)
+
+
+def write_export(path: str, chunks: Iterable[bytes]) -> int:
+    # Written under a temp name so a failed export never leaves a partial file.
+    tmp_path = f"{path}.part"
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size
+
+
+def write_parquet(path: str, rows: Iterable[Sequence], columns: Sequence[tuple],
+                  row_group_size: int = PARQUET_ROW_GROUP_SIZE) -> int:
+    # rows: value tuples without a header. columns: (name, kind) in row order, kind one of "int", "str",
+    # "dict" (dictionary-encoded string) or "timestamp" (epoch seconds).
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    types = {
+        "int": pa.int64(),
+        "str": pa.string(),
+        "dict": pa.dictionary(pa.int32(), pa.string()),
+        "timestamp": pa.timestamp("s", tz="UTC"),
+    }
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+
+    def to_array(values, kind):
+        if kind == "dict":
+            return pa.array(values, type=pa.string()).dictionary_encode()
+        return pa.array(values, type=types[kind])
+
+    def write_group(writer, batch):
+        arrays = [to_array(values, kind) for values, (_, kind) in zip(zip(*batch), columns)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=row_group_size)
+
+    tmp_path = f"{path}.part"
+    written = 0
+    try:
+        # Only one row group's worth of rows is held at a time.
+        with pq.ParquetWriter(tmp_path, schema, compression=PARQUET_COMPRESSION) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= row_group_size:
+                    write_group(writer, batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                write_group(writer, batch)
+                written += len(batch)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return written
@@ -0,0 +1,499 @@
+import atexit
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from . import db
+
+# An incremental chain is one full base snapshot followed by the WAL frames
+# committed after it, archived in segments. Restoring replays the frames onto
+# the base, so point-in-time restore has segment granularity (one restore
+# point per archive run) and each run only copies what changed.
+WAL_ARCHIVE_INTERVAL = 300.0
+INCREMENTAL_COMPRESSION = None  # None or "gzip"
+INCREMENTAL_MAX_CHAINS = 2
+# Writers are only held off once the unarchived tail is this small.
+ARCHIVE_CATCHUP_PASSES = 5
+ARCHIVE_LOCKED_TAIL_BYTES = 4 * 1024 * 1024
+INCREMENTAL_DIR_NAME = "incremental"
+MANIFEST_NAME = "manifest.json"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# WAL layout: https://www.sqlite.org/fileformat.html#the_write_ahead_log
+_WAL_HEADER = struct.Struct(">8I")
+_FRAME_HEADER = struct.Struct(">6I")
+_WAL_MAGIC = (0x377F0682, 0x377F0683)
+_MASK = 0xFFFFFFFF
+
+_archive_lock = threading.Lock()
+_last_incremental_stats = {}
+
+
+class _ChainBroken(Exception):
+    pass
+
+
+def _incremental_dir() -> str:
+    return os.path.join(db.DB_BACKUP_DIR, INCREMENTAL_DIR_NAME)
+
+
+def _wal_path() -> str:
+    return db.DB_PATH + "-wal"
+
+
+def _wal_checksum(data: bytes, s0: int, s1: int, big_endian: bool) -> tuple:
+    words = struct.unpack(f"{'>' if big_endian else '<'}{len(data) // 4}I", data)
+    pairs = iter(words)
+    for a, b in zip(pairs, pairs):
+        s0 = (s0 + a + s1) & _MASK
+        s1 = (s1 + b + s0) & _MASK
+    return s0, s1
+
+
+def _read_wal_header(f) -> Optional[dict]:
+    raw = f.read(_WAL_HEADER.size)
+    if len(raw) < _WAL_HEADER.size:
+        return None
+    magic, _, page_size, seq, salt1, salt2, c0, c1 = _WAL_HEADER.unpack(raw)
+    big_endian = bool(magic & 1)
+    if magic not in _WAL_MAGIC or _wal_checksum(raw[:24], 0, 0, big_endian) != (c0, c1):
+        return None
+    return {"page_size": page_size, "seq": seq, "salt1": salt1, "salt2": salt2,
+            "checksum": [c0, c1], "big_endian": big_endian}
+
+
+def _generation_start() -> Optional[dict]:
+    try:
+        with open(_wal_path(), "rb") as f:
+            header = _read_wal_header(f)
+    except FileNotFoundError:
+        return None
+    if header is None:
+        return None
+    return {"seq": header["seq"], "salt1": header["salt1"], "salt2": header["salt2"],
+            "offset": _WAL_HEADER.size, "checksum": header["checksum"], "checkpointed": False}
+
+
+def _scan_wal(cursor: Optional[dict]) -> Optional[dict]:
+    # Returns {"start", "cursor", "commits", "page_size"} covering the whole
+    # transactions committed after cursor, or None if there is no WAL yet.
+    try:
+        f = open(_wal_path(), "rb")
+    except FileNotFoundError:
+        if cursor is None:
+            return None
+        raise _ChainBroken("WAL file disappeared")
+
+    with f:
+        header = _read_wal_header(f)
+        if header is None:
+            if cursor is None:
+                return None
+            raise _ChainBroken("WAL header missing or invalid")
+
+        generation = (header["seq"], header["salt1"], header["salt2"])
+        if cursor is not None and generation == (cursor["seq"], cursor["salt1"], cursor["salt2"]):
+            offset, checksum = cursor["offset"], tuple(cursor["checksum"])
+        elif cursor is None or (
+            cursor["checkpointed"]
+            and header["seq"] == cursor["seq"] + 1
+            and header["salt1"] == (cursor["salt1"] + 1) & _MASK
+        ):
+            # The restart that follows our own complete checkpoint: the
+            # previous generation was fully archived before it.
+            offset, checksum = _WAL_HEADER.size, tuple(header["checksum"])
+        else:
+            # Someone else checkpointed; frames may have been recycled
+            # before we saw them.
+            raise _ChainBroken(f"WAL reset outside the archiver (checkpoint seq {header['seq']})")
+
+        start = offset
+        frame_size = _FRAME_HEADER.size + header["page_size"]
+        end, end_checksum, commits = offset, checksum, 0
+        # Stop at the size seen now, or a busy writer keeps us chasing
+        # the end of the file.
+        limit = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        while offset + frame_size <= limit:
+            frame = f.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            _, db_size, salt1, salt2, c0, c1 = _FRAME_HEADER.unpack_from(frame)
+            if (salt1, salt2) != (header["salt1"], header["salt2"]):
+                break
+            checksum = _wal_checksum(frame[:8] + frame[_FRAME_HEADER.size:], *checksum, header["big_endian"])
+            if checksum != (c0, c1):
+                break
+            offset += frame_size
+            # Only whole transactions are archived; a trailing partial one
+            # is picked up by the next run.
+            if db_size:
+                end, end_checksum = offset, checksum
+                commits += 1
+
+    # A complete checkpoint stays valid until new frames are committed.
+    checkpointed = bool(cursor and cursor["checkpointed"] and end == cursor["offset"]
+                        and generation == (cursor["seq"], cursor["salt1"], cursor["salt2"]))
+    return {
+        "start": start,
+        "commits": commits,
+        "page_size": header["page_size"],
+        "cursor": {"seq": header["seq"], "salt1": header["salt1"], "salt2": header["salt2"],
+                   "offset": end, "checksum": list(end_checksum), "checkpointed": checkpointed},
+    }
+
+
+def _copy_wal_range(dest, start: int, end: int) -> None:
+    with open(_wal_path(), "rb") as src:
+        src.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = src.read(min(db.COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise _ChainBroken("WAL shrank while archiving")
+            dest.write(chunk)
+            remaining -= len(chunk)
+
+
+def _write_manifest(chain_dir: str, manifest: dict) -> None:
+    tmp_path = os.path.join(chain_dir, f".{MANIFEST_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(chain_dir, MANIFEST_NAME))
+
+
+def _load_chains() -> list:
+    # Newest first, as recorded in the backup catalog.
+    chains = []
+    for entry in db.list_backups("chain"):
+        chain_dir = os.path.join(db.DB_BACKUP_DIR, entry["file"])
+        with open(os.path.join(chain_dir, MANIFEST_NAME)) as f:
+            chains.append((chain_dir, json.load(f)))
+    return chains
+
+
+def _archive_segment(chain_dir: str, manifest: dict, compression: Optional[str]) -> Optional[dict]:
+    started = time.perf_counter()
+    scan = _scan_wal(manifest["cursor"])
+    if scan is None:
+        return None
+
+    index = len(manifest["segments"]) + 1
+    file_name = f"{index:06d}.wal{'.gz' if compression == 'gzip' else ''}"
+    tmp_path = os.path.join(chain_dir, f".{file_name}.tmp")
+    opener = gzip.open if compression == "gzip" else open
+    try:
+        with opener(tmp_path, "wb") as out:
+            # Catch up without blocking writers: nothing but this archiver
+            # checkpoints, so these frames cannot move. Under heavy write
+            # load each pass is shorter than the last.
+            part, commits, copied = scan, 0, 0
+            for _ in range(ARCHIVE_CATCHUP_PASSES):
+                _copy_wal_range(out, part["start"], part["cursor"]["offset"])
+                cursor, commits = part["cursor"], commits + part["commits"]
+                copied += part["cursor"]["offset"] - part["start"]
+                if part["cursor"]["offset"] - part["start"] <= ARCHIVE_LOCKED_TAIL_BYTES:
+                    break
+                part = _scan_wal(cursor)
+
+            # The checkpoint must not backfill frames we have not copied, so
+            # writers are held off while the short tail is archived.
+            with db.get_connection() as writer:
+                try:
+                    writer.execute("BEGIN IMMEDIATE;")
+                except sqlite3.OperationalError as e:
+                    print(f"[DB WARNING] Skipping WAL checkpoint, database busy: {e}")
+                else:
+                    try:
+                        tail = _scan_wal(cursor)
+                        _copy_wal_range(out, tail["start"], tail["cursor"]["offset"])
+                        cursor, commits = tail["cursor"], commits + tail["commits"]
+                        copied += tail["cursor"]["offset"] - tail["start"]
+                        with db.get_connection() as checkpointer:
+                            busy, log, done = checkpointer.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchone()
+                        cursor["checkpointed"] = busy == 0 and log == done
+                    finally:
+                        writer.rollback()
+
+        frames = copied // (_FRAME_HEADER.size + scan["page_size"])
+        manifest["cursor"] = cursor
+        if frames == 0:
+            return None
+
+        segment_path = os.path.join(chain_dir, file_name)
+        os.replace(tmp_path, segment_path)
+        size = os.path.getsize(segment_path)
+
+        segment = {
+            "file": file_name,
+            "created_at": datetime.now().strftime(TIMESTAMP_FORMAT),
+            "page_size": scan["page_size"],
+            "frames": frames,
+            "commits": commits,
+            "bytes": size,
+            "seconds": time.perf_counter() - started,
+        }
+        manifest["segments"].append(segment)
+        return segment
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _start_chain(compression: Optional[str]) -> dict:
+    created_at = datetime.now()
+    name = created_at.strftime("chain_%Y%m%d_%H%M%S_%f")
+    chain_dir = os.path.join(_incremental_dir(), name)
+    os.makedirs(chain_dir)
+    try:
+        return _build_chain(chain_dir, name, created_at, compression)
+    except BaseException:
+        # An unregistered chain is invisible to retention, so never leave
+        # a half-built one (and its full base copy) behind.
+        shutil.rmtree(chain_dir, ignore_errors=True)
+        raise
+
+
+def _build_chain(chain_dir: str, name: str, created_at: datetime, compression: Optional[str]) -> dict:
+    # Frames from here on are replayed over the base. Those already in the
+    # base are rewritten with the same or newer contents, so starting early
+    # is safe.
+    cursor = _generation_start()
+
+    tmp_path = os.path.join(chain_dir, ".base.tmp")
+    base_name = "base.db.gz" if compression == "gzip" else "base.db"
+    try:
+        stats = db.online_backup(tmp_path)
+        if compression == "gzip":
+            db.copy_stream(tmp_path, os.path.join(chain_dir, base_name), dest_opener=gzip.open)
+        else:
+            os.replace(tmp_path, os.path.join(chain_dir, base_name))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    base_done = datetime.now()
+
+    manifest = {
+        "chain": name,
+        "created_at": created_at.strftime(TIMESTAMP_FORMAT),
+        "base": base_name,
+        "base_bytes": os.path.getsize(os.path.join(chain_dir, base_name)),
+        "cursor": cursor,
+        # Segment 0 is the base itself, the chain's earliest restore point,
+        # stamped when the copy finished. It is recorded even when there is
+        # no WAL to archive yet (e.g. it was just removed on close).
+        "segments": [{"file": None, "created_at": base_done.strftime(TIMESTAMP_FORMAT), "page_size": None,
+                      "frames": 0, "commits": 0, "bytes": 0, "seconds": 0.0}],
+        "closed": None,
+    }
+    _archive_segment(chain_dir, manifest, compression)
+    _write_manifest(chain_dir, manifest)
+    db.register_backup({
+        "kind": "chain",
+        "file": os.path.relpath(chain_dir, db.DB_BACKUP_DIR),
+        "size": manifest["base_bytes"],
+        "sha256": db.file_sha256(os.path.join(chain_dir, base_name)),
+        "row_counts": stats["row_counts"],
+        "compression": compression,
+        "created_at": manifest["created_at"],
+    })
+
+    print(f"[DB] Started incremental chain {name} with a {stats['bytes_copied'] / 1024 / 1024:.1f} MiB base.")
+    return {"kind": "full", "chain": name, "bytes_written": manifest["base_bytes"], "seconds": stats["seconds"]}
+
+
+def _prune_chains() -> None:
+    for chain_dir, manifest in _load_chains()[INCREMENTAL_MAX_CHAINS:]:
+        try:
+            shutil.rmtree(chain_dir)
+            db.unregister_backup(os.path.relpath(chain_dir, db.DB_BACKUP_DIR))
+            print(f"[DB] Deleted old incremental chain: {manifest['chain']}")
+        except OSError as e:
+            print(f"[DB WARNING] Could not delete incremental chain {chain_dir}: {e}")
+
+
+def create_incremental_backup(compression: Optional[str] = INCREMENTAL_COMPRESSION) -> Optional[dict]:
+    if compression not in (None, "gzip"):
+        raise ValueError(f"Unknown incremental backup compression: {compression}")
+
+    with _archive_lock:
+        try:
+            if not os.path.exists(db.DB_PATH):
+                print("[DB] No database file to backup.")
+                return None
+            os.makedirs(_incremental_dir(), exist_ok=True)
+
+            chains = _load_chains()
+            result = None
+            if chains and not chains[0][1]["closed"]:
+                chain_dir, manifest = chains[0]
+                started = time.perf_counter()
+                try:
+                    segment = _archive_segment(chain_dir, manifest, compression)
+                    _write_manifest(chain_dir, manifest)
+                    result = {
+                        "kind": "incremental",
+                        "chain": manifest["chain"],
+                        "frames": segment["frames"] if segment else 0,
+                        "bytes_written": segment["bytes"] if segment else 0,
+                        "seconds": time.perf_counter() - started,
+                    }
+                except _ChainBroken as e:
+                    # The chain still restores up to its last segment; it
+                    # just cannot be extended.
+                    manifest["closed"] = str(e)
+                    _write_manifest(chain_dir, manifest)
+                    print(f"[DB WARNING] Incremental chain {manifest['chain']} closed: {e}")
+
+            if result is None:
+                result = _start_chain(compression)
+                _prune_chains()
+            elif result["frames"]:
+                print(
+                    f"[DB] Archived {result['frames']} WAL frames ({result['bytes_written']} bytes) "
+                    f"to {result['chain']} in {result['seconds']:.3f}s."
+                )
+
+            # A new chain's base copy is a full backup; time it separately.
+            db.record_backup_duration("chain_base" if result["kind"] == "full" else "incremental", result["seconds"])
+            _last_incremental_stats.clear()
+            _last_incremental_stats.update(result)
+            return result
+
+        except Exception as e:
+            db.record_backup_failure("incremental")
+            print(f"[DB ERROR] Incremental backup failed: {e}")
+            return None
+
+
+def get_last_incremental_stats() -> dict:
+    return dict(_last_incremental_stats)
+
+
+def list_restore_points() -> list:
+    points = []
+    for _, manifest in _load_chains():
+        for index, segment in enumerate(manifest["segments"]):
+            points.append({"chain": manifest["chain"], "segment": index, "created_at": segment["created_at"]})
+    points.sort(key=lambda p: p["created_at"], reverse=True)
+    return points
+
+
+def _replay_segments(db_file: str, chain_dir: str, segments: list) -> None:
+    with open(db_file, "r+b") as out:
+        for segment in segments:
+            if not segment["file"]:
+                continue
+            page_size = segment["page_size"]
+            opener = gzip.open if segment["file"].endswith(".gz") else open
+            with opener(os.path.join(chain_dir, segment["file"]), "rb") as f:
+                while True:
+                    frame_header = f.read(_FRAME_HEADER.size)
+                    if not frame_header:
+                        break
+                    page = f.read(page_size)
+                    if len(frame_header) < _FRAME_HEADER.size or len(page) < page_size:
+                        raise ValueError(f"Truncated WAL segment: {segment['file']}")
+                    pgno, db_size = _FRAME_HEADER.unpack(frame_header)[:2]
+                    out.seek((pgno - 1) * page_size)
+                    out.write(page)
+                    if db_size:
+                        out.truncate(db_size * page_size)
+
+
+def restore_to_point_in_time(target: datetime) -> bool:
+    try:
+        chosen = None
+        for chain_dir, manifest in _load_chains():
+            usable = [s for s in manifest["segments"]
+                      if datetime.strptime(s["created_at"], TIMESTAMP_FORMAT) <= target]
+            if usable:
+                chosen = (chain_dir, manifest, usable)
+                break
+        if chosen is None:
+            print(f"[DB ERROR] No restore point at or before {target:%Y-%m-%d %H:%M:%S}.")
+            return False
+
+        chain_dir, manifest, segments = chosen
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(db.DB_PATH)) as tmp_dir:
+            source_path = os.path.join(tmp_dir, "pitr.db")
+            base_path = os.path.join(chain_dir, manifest["base"])
+            entry = db.find_backup(os.path.relpath(chain_dir, db.DB_BACKUP_DIR))
+            if entry and db.file_sha256(base_path) != entry["sha256"]:
+                print(f"[DB ERROR] Base snapshot checksum does not match the catalog: {base_path}")
+                return False
+            db.copy_stream(base_path, source_path, src_opener=gzip.open if base_path.endswith(".gz") else open)
+            _replay_segments(source_path, chain_dir, segments)
+            if not db.restore_database_file(source_path):
+                return False
+
+        print(f"[DB] Database restored to {segments[-1]['created_at']} from chain {manifest['chain']}.")
+        return True
+
+    except Exception as e:
+        print(f"[DB ERROR] Point-in-time restore failed: {e}")
+        return False
+
+
+class WalArchiver:
+    def __init__(self, interval: float = WAL_ARCHIVE_INTERVAL):
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {"runs": 0, "failures": 0, "last_run": None}
+
+    def start(self) -> Optional[dict]:
+        if self._thread is not None and self._thread.is_alive():
+            return None
+        # From here on only the archiver checkpoints; reopen pooled
+        # connections so none of them still auto-checkpoints.
+        db.WAL_AUTOCHECKPOINT = 0
+        db.close_pool()
+        result = self.run_once()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="wal-archiver", daemon=True)
+        self._thread.start()
+        return result
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def run_once(self) -> Optional[dict]:
+        result = create_incremental_backup()
+        self._stats["runs"] += 1
+        self._stats["failures"] += result is None
+        self._stats["last_run"] = datetime.now().strftime(TIMESTAMP_FORMAT)
+        return result
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["interval"] = self.interval
+        stats["running"] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+
+_archiver = WalArchiver()
+atexit.register(_archiver.stop)
+
+
+def start_wal_archiver() -> Optional[dict]:
+    return _archiver.start()
+
+
+def get_wal_archiver_stats() -> dict:
+    return _archiver.stats()
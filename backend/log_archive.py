@@ -0,0 +1,386 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Iterator, Optional
+
+from . import db
+from .cache import bump_data_version
+from .exports import iter_query_rows
+from .migrations import LOGS_FTS_REBUILD_SQL, LOGS_FTS_SQL
+
+# The hot `logs` table keeps the current month and the LOG_HOT_MONTHS - 1
+# before it; older months live in one SQLite file each, ATTACHed only when
+# a query reaches back that far.
+LOG_HOT_MONTHS = 2
+LOG_ARCHIVE_BATCH_SIZE = 5000
+LOG_ARCHIVE_BATCH_PAUSE = 0.01
+LOG_SEARCH_PAGE_SIZE = 25
+# bm25 column weights for (action, details).
+LOG_SEARCH_WEIGHTS = (2.0, 1.0)
+
+LOG_COLUMNS = ("id", "username", "role", "action", "details", "created_at", "created_ts")
+_COLUMN_LIST = ", ".join(LOG_COLUMNS)
+
+_ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.logs (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        role TEXT,
+        action TEXT,
+        details TEXT,
+        created_at TEXT,
+        created_ts INTEGER
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_logs_created_ts ON logs(created_ts);",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_logs_username_ts ON logs(username, created_ts);",
+)
+
+# One batch of a month's rows, oldest first.
+_BATCH_IDS = "SELECT id FROM main.logs WHERE created_ts >= ? AND created_ts < ? ORDER BY created_ts, id LIMIT ?"
+# The batch's ids are passed as one JSON array parameter.
+_IDS_PARAM = "SELECT value FROM json_each(?)"
+
+
+def _archive_dir() -> str:
+    return os.path.join(os.path.dirname(db.DB_PATH), "log_archive")
+
+
+def _month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def hot_window_start(hot_months: int = LOG_HOT_MONTHS) -> int:
+    return int(_add_months(_month_start(datetime.now()), -(hot_months - 1)).timestamp())
+
+
+def _has_fts(conn: sqlite3.Connection, schema: str) -> bool:
+    return conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'logs_fts';"
+    ).fetchone() is not None
+
+
+def _ensure_archive_schema(conn: sqlite3.Connection) -> None:
+    # Archive files made before the search index existed get it on first use.
+    had_fts = _has_fts(conn, "archive")
+    for statement in _ARCHIVE_SCHEMA:
+        conn.execute(statement.format(schema="archive"))
+    if not had_fts:
+        try:
+            for statement in LOGS_FTS_SQL:
+                conn.execute(statement.format(schema="archive"))
+            conn.execute(LOGS_FTS_REBUILD_SQL.format(schema="archive"))
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            print(f"[LOG WARNING] No full-text index for archive: {e}")
+    conn.commit()
+
+
+@contextmanager
+def _attached(conn: sqlite3.Connection, path: str, alias: str = "archive"):
+    conn.execute("ATTACH DATABASE ? AS " + alias + ";", (path,))
+    try:
+        yield conn
+    finally:
+        # Pooled connections are reused; never hand one back still attached.
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute(f"DETACH DATABASE {alias};")
+
+
+def _archive_month(month: datetime, batch_size: int) -> int:
+    start_ts = int(month.timestamp())
+    end_ts = int(_add_months(month, 1).timestamp())
+    key = month.strftime("%Y-%m")
+    file_name = f"logs_{month:%Y_%m}.db"
+    os.makedirs(_archive_dir(), exist_ok=True)
+
+    moved = 0
+    with db.get_connection() as conn, _attached(conn, os.path.join(_archive_dir(), file_name)):
+        _ensure_archive_schema(conn)
+
+        while True:
+            ids = [row[0] for row in conn.execute(_BATCH_IDS, (start_ts, end_ts, batch_size))]
+            if not ids:
+                break
+            batch = json.dumps(ids)
+            # main is in WAL mode, so one transaction across both files is
+            # not atomic on a crash. The copy is committed to the archive
+            # first and the rows are deleted from main only afterwards: a
+            # crash in between leaves them in both, and the re-run's
+            # OR IGNORE skips the copies it already has.
+            conn.execute("BEGIN;")
+            conn.execute(
+                f"INSERT OR IGNORE INTO archive.logs ({_COLUMN_LIST}) "
+                f"SELECT {_COLUMN_LIST} FROM main.logs WHERE id IN ({_IDS_PARAM});",
+                (batch,),
+            )
+            conn.commit()
+
+            conn.execute("BEGIN IMMEDIATE;")
+            cur = conn.execute(
+                f"DELETE FROM main.logs WHERE id IN ({_IDS_PARAM}) AND id IN (SELECT id FROM archive.logs);",
+                (batch,),
+            )
+            conn.commit()
+            if not cur.rowcount:
+                break
+            moved += cur.rowcount
+            time.sleep(LOG_ARCHIVE_BATCH_PAUSE)
+
+        row_count, min_ts, max_ts = conn.execute(
+            "SELECT COUNT(*), MIN(created_ts), MAX(created_ts) FROM archive.logs;"
+        ).fetchone()
+        conn.execute(
+            """
+            INSERT INTO main.log_archive_months (month, file, row_count, min_ts, max_ts, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(month) DO UPDATE SET
+                row_count = excluded.row_count, min_ts = excluded.min_ts,
+                max_ts = excluded.max_ts, archived_at = excluded.archived_at;
+            """,
+            (key, file_name, row_count, min_ts, max_ts, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        )
+        conn.commit()
+
+    return moved
+
+
+def archive_old_logs(hot_months: int = LOG_HOT_MONTHS, batch_size: int = LOG_ARCHIVE_BATCH_SIZE) -> dict:
+    cutoff_ts = hot_window_start(hot_months)
+    months, rows = [], 0
+    try:
+        while True:
+            with db.get_connection() as conn:
+                oldest = conn.execute("SELECT MIN(created_ts) FROM logs;").fetchone()[0]
+            if oldest is None or oldest >= cutoff_ts:
+                break
+
+            month = _month_start(datetime.fromtimestamp(oldest))
+            moved = _archive_month(month, batch_size)
+            if not moved:
+                raise RuntimeError(f"No rows moved for {month:%Y-%m}; stopping to avoid a loop")
+            months.append(month.strftime("%Y-%m"))
+            rows += moved
+            print(f"[LOG] Archived {moved} log entries from {month:%Y-%m}.")
+
+        if rows:
+            bump_data_version("logs")
+        return {"months": months, "rows": rows}
+
+    except Exception as e:
+        print(f"[LOG ERROR] Failed to archive old logs: {e}")
+        raise
+
+
+def list_archived_months(start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> list:
+    # Newest first.
+    with db.get_connection() as conn:
+        return conn.execute(
+            """
+            SELECT month, file, row_count, min_ts, max_ts FROM log_archive_months
+            WHERE (? IS NULL OR max_ts >= ?) AND (? IS NULL OR min_ts <= ?)
+            ORDER BY month DESC;
+            """,
+            (start_ts, start_ts, end_ts, end_ts),
+        ).fetchall()
+
+
+def _log_filters(start_ts, end_ts, username, role, action, prefix: str = "") -> tuple:
+    clauses, params = [], []
+    for clause, value in (("created_ts >= ?", start_ts), ("created_ts <= ?", end_ts),
+                          ("username = ?", username), ("role = ?", role), ("action = ?", action)):
+        if value is not None:
+            clauses.append(prefix + clause)
+            params.append(value)
+    return clauses, params
+
+
+def query_logs(limit: int = 100, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+               username: Optional[str] = None, role: Optional[str] = None,
+               action: Optional[str] = None) -> list:
+    # Newest first across the hot table and any archive months in range.
+    # Archives are visited newest to oldest and only while they can still
+    # contribute to the first `limit` rows.
+    clauses, params = _log_filters(start_ts, end_ts, username, role, action)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT {_COLUMN_LIST} FROM {{table}} {where} ORDER BY created_ts DESC, id DESC LIMIT ?;"
+    order = lambda r: (r["created_ts"] or 0, r["id"])
+
+    with db.get_connection() as conn:
+        rows = conn.execute(sql.format(table="main.logs"), (*params, limit)).fetchall()
+
+    for month in list_archived_months(start_ts, end_ts):
+        if len(rows) >= limit and order(rows[-1])[0] > (month["max_ts"] or 0):
+            break
+        path = os.path.join(_archive_dir(), month["file"])
+        if not os.path.exists(path):
+            print(f"[LOG WARNING] Archive file missing for {month['month']}: {path}")
+            continue
+        with db.get_connection() as conn, _attached(conn, path):
+            rows += conn.execute(sql.format(table="archive.logs"), (*params, limit)).fetchall()
+        rows = sorted(rows, key=order, reverse=True)[:limit]
+
+    return rows
+
+
+def _fts_query(text: str) -> str:
+    # Each whitespace-separated term becomes a quoted FTS5 string, so user
+    # input is matched literally (all terms required) and never parsed as
+    # query syntax.
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+def _search_source(conn: sqlite3.Connection, schema: str, text: str, clauses: list, params: list,
+                   limit: int) -> tuple:
+    columns = ", ".join(f"l.{c}" for c in LOG_COLUMNS)
+    if _has_fts(conn, schema):
+        weights = ", ".join(str(w) for w in LOG_SEARCH_WEIGHTS)
+        # FTS5 needs the table's own name for MATCH and bm25(), not an alias.
+        source = f"FROM {schema}.logs_fts JOIN {schema}.logs AS l ON l.id = logs_fts.rowid"
+        where = " AND ".join(["logs_fts MATCH ?"] + clauses)
+        match_params = [_fts_query(text), *params]
+        total = conn.execute(f"SELECT COUNT(*) {source} WHERE {where};", match_params).fetchone()[0]
+        rows = conn.execute(
+            f"""
+            SELECT {columns}, bm25(logs_fts, {weights}) AS score,
+                   snippet(logs_fts, 1, '«', '»', '…', 12) AS snippet
+            {source} WHERE {where}
+            ORDER BY score LIMIT ?;
+            """,
+            (*match_params, limit),
+        ).fetchall()
+        return rows, total
+
+    # No FTS5 in this SQLite build: unranked substring match, newest first.
+    like_clauses, like_params = [], []
+    for term in text.split():
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        like_clauses.append("(l.action LIKE ? ESCAPE '\\' OR l.details LIKE ? ESCAPE '\\')")
+        like_params += [pattern, pattern]
+    source = f"FROM {schema}.logs AS l"
+    where = " AND ".join(like_clauses + clauses)
+    total = conn.execute(f"SELECT COUNT(*) {source} WHERE {where};", (*like_params, *params)).fetchone()[0]
+    rows = conn.execute(
+        f"""
+        SELECT {columns}, 0.0 AS score, substr(l.details, 1, 120) AS snippet
+        {source} WHERE {where}
+        ORDER BY l.created_ts DESC LIMIT ?;
+        """,
+        (*like_params, *params, limit),
+    ).fetchall()
+    return rows, total
+
+
+def search_logs(text: str, username: Optional[str] = None, role: Optional[str] = None,
+                start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                page: int = 1, page_size: int = LOG_SEARCH_PAGE_SIZE) -> dict:
+    # Best bm25 match first, then newest. Archive months in the date range
+    # are searched through their own index; their scores are merged as-is,
+    # which is close enough across months of the same kind of log text.
+    result = {"rows": [], "total": 0, "page": page, "page_size": page_size}
+    if not text.split():
+        return result
+
+    clauses, params = _log_filters(start_ts, end_ts, username, role, None, prefix="l.")
+    wanted = page * page_size
+    sources = [("main", None)]
+    for month in list_archived_months(start_ts, end_ts):
+        path = os.path.join(_archive_dir(), month["file"])
+        if os.path.exists(path):
+            sources.append(("archive", path))
+
+    rows = []
+    for schema, path in sources:
+        with db.get_connection() as conn, (_attached(conn, path) if path else nullcontext()):
+            if path:
+                _ensure_archive_schema(conn)
+            found, total = _search_source(conn, schema, text, clauses, params, wanted)
+        rows += found
+        result["total"] += total
+
+    rows.sort(key=lambda r: (r["score"], -(r["created_ts"] or 0)))
+    result["rows"] = rows[(page - 1) * page_size:wanted]
+    return result
+
+
+def iter_all_log_rows(columns=LOG_COLUMNS, descending: bool = True) -> Iterator[tuple]:
+    # Streams hot rows and every archive month in time order, for exports.
+    column_list = ", ".join(columns)
+    order = "DESC" if descending else "ASC"
+    months = list_archived_months()
+    if not descending:
+        months = list(reversed(months))
+
+    def hot():
+        yield from iter_query_rows(
+            f"SELECT {column_list} FROM logs ORDER BY created_ts {order}, id {order};", include_header=False
+        )
+
+    def archived():
+        for month in months:
+            path = os.path.join(_archive_dir(), month["file"])
+            if not os.path.exists(path):
+                continue
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                cur = conn.execute(f"SELECT {column_list} FROM logs ORDER BY created_ts {order}, id {order};")
+                while True:
+                    batch = cur.fetchmany(LOG_ARCHIVE_BATCH_SIZE)
+                    if not batch:
+                        break
+                    yield from batch
+            finally:
+                conn.close()
+
+    if descending:
+        yield from hot()
+        yield from archived()
+    else:
+        yield from archived()
+        yield from hot()
+
+
+def purge_log_archives(cutoff_ts: int) -> int:
+    # Retention for archived months: whole files past the cutoff are simply
+    # removed; only the month straddling it needs row deletes.
+    removed = 0
+    for month in list_archived_months(end_ts=cutoff_ts - 1):
+        path = os.path.join(_archive_dir(), month["file"])
+        if month["max_ts"] is not None and month["max_ts"] < cutoff_ts:
+            if os.path.exists(path):
+                os.remove(path)
+            with db.get_connection() as conn:
+                conn.execute("DELETE FROM log_archive_months WHERE month = ?;", (month["month"],))
+                conn.commit()
+            removed += month["row_count"]
+            print(f"[RETENTION] Dropped log archive {month['month']} ({month['row_count']} entries).")
+            continue
+
+        if not os.path.exists(path):
+            continue
+        with db.get_connection() as conn, _attached(conn, path):
+            conn.execute("BEGIN IMMEDIATE;")
+            cur = conn.execute("DELETE FROM archive.logs WHERE created_ts < ?;", (cutoff_ts,))
+            row_count, min_ts, max_ts = conn.execute(
+                "SELECT COUNT(*), MIN(created_ts), MAX(created_ts) FROM archive.logs;"
+            ).fetchone()
+            conn.execute(
+                "UPDATE main.log_archive_months SET row_count = ?, min_ts = ?, max_ts = ? WHERE month = ?;",
+                (row_count, min_ts, max_ts, month["month"]),
+            )
+            conn.commit()
+            removed += cur.rowcount
+
+    if removed:
+        bump_data_version("logs")
+    return removed
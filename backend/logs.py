@@ -1,46 +1,240 @@
+import atexit
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
-from .db import get_connection
+from typing import Iterator
+from .cache import bump_data_version, cacheable
+from .db import get_connection, incremental_vacuum
+from .exports import iter_csv, iter_gzip, write_export, write_parquet
+from .log_archive import iter_all_log_rows, list_archived_months, purge_log_archives
+from .metrics import REGISTRY
 
+ASYNC_LOGGING = True
+LOG_QUEUE_MAX = 10000
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 0.5
+LOG_ENQUEUE_TIMEOUT = 2.0
+# A failed batch (e.g. "database is locked" past the busy timeout) is
+# retried this many times, pausing LOG_FLUSH_RETRY_PAUSE doubling, then
+# written row by row so only rows that fail on their own are lost.
+LOG_FLUSH_RETRIES = 3
+LOG_FLUSH_RETRY_PAUSE = 0.1
+# Rows per retention DELETE transaction, and the pause between them.
+CLEANUP_BATCH_SIZE = 5000
+CLEANUP_BATCH_PAUSE = 0.01
+LOG_EXPORT_HEADER = ("ID", "Username", "Role", "Action", "Details", "Timestamp")
+LOG_PARQUET_COLUMNS = (
+    ("id", "int"), ("username", "dict"), ("role", "dict"), ("action", "dict"),
+    ("details", "str"), ("created_at", "timestamp"),
+)
 
-def log_action(username: str, role: str, action: str, details: str = ""):
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        cur.execute(
+_STOP = object()
+
+LOG_ACTION_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+# "queued" is the caller-visible cost of handing a row to the writer
+# thread; "direct" includes the INSERT and commit.
+_log_action_seconds = REGISTRY.histogram("hms_log_action_seconds", "Time spent inside log_action().",
+                                         ("mode",), buckets=LOG_ACTION_BUCKETS)
+
+
+def _write_log_rows(rows: list) -> None:
+    with get_connection() as conn:
+        conn.executemany(
             """
-            INSERT INTO logs (username, role, action, details, created_at)
-            VALUES (?, ?, ?, ?, ?);
+            INSERT INTO logs (username, role, action, details, created_at, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?);
             """,
-            (username, role, action, details, current_time),
+            rows,
         )
-        
         conn.commit()
-        conn.close()
+    bump_data_version("logs")
+
+
+class AuditLogWriter:
+    def __init__(self, max_queue: int = LOG_QUEUE_MAX, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0, "written": 0, "failed": 0, "sync_fallbacks": 0,
+            "flushes": 0, "flush_time": 0.0, "max_flush_time": 0.0, "last_flush_time": 0.0,
+        }
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, row: tuple) -> bool:
+        self._ensure_started()
+        try:
+            # Blocking put is the backpressure; a stalled writer degrades
+            # to synchronous inserts instead of dropping events.
+            self._queue.put(row, timeout=LOG_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["sync_fallbacks"] += 1
+            return False
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        # The whole call, enqueueing included, is bounded by timeout.
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(max(0.0, deadline - time.monotonic()))
+
+    def shutdown(self, timeout: float = 10.0) -> bool:
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return False
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        return not self._thread.is_alive()
+
+    def _write_batch(self, batch: list) -> int:
+        # Returns the number of rows that could not be written.
+        pause = LOG_FLUSH_RETRY_PAUSE
+        for attempt in range(LOG_FLUSH_RETRIES + 1):
+            try:
+                _write_log_rows(batch)
+                return 0
+            except Exception as e:
+                print(f"[LOG WARNING] Flush of {len(batch)} log entries failed (attempt {attempt + 1}): {e}")
+            if attempt < LOG_FLUSH_RETRIES:
+                time.sleep(pause)
+                pause *= 2
+
+        failed = 0
+        for row in batch:
+            try:
+                _write_log_rows([row])
+            except Exception as e:
+                failed += 1
+                print(f"[LOG ERROR] Failed to write log entry {row[:3]}: {e}")
+        return failed
+
+    def _flush_batch(self, batch: list) -> None:
+        started = time.perf_counter()
+        failed = self._write_batch(batch)
+        written = len(batch) - failed
+        elapsed = time.perf_counter() - started
+
+        with self._stats_lock:
+            self._stats["written"] += written
+            self._stats["failed"] += failed
+            self._stats["flushes"] += 1
+            self._stats["flush_time"] += elapsed
+            self._stats["last_flush_time"] = elapsed
+            self._stats["max_flush_time"] = max(self._stats["max_flush_time"], elapsed)
+
+    def _run(self) -> None:
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            waiter = None
+            stop = False
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, threading.Event):
+                waiter = item
+            elif item is not None:
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                self._flush_batch(batch)
+                batch = []
+            if waiter is not None:
+                waiter.set()
+            if stop:
+                return
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_max"] = self._queue.maxsize
+        stats["avg_flush_time"] = stats["flush_time"] / stats["flushes"] if stats["flushes"] else 0.0
+        stats["running"] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+
+_log_writer = AuditLogWriter()
+atexit.register(_log_writer.shutdown)
+
+
+def flush_logs(timeout: float = 10.0) -> bool:
+    return _log_writer.flush(timeout)
+
+
+def get_log_writer_stats() -> dict:
+    return _log_writer.stats()
+
+
+def log_action(username: str, role: str, action: str, details: str = "", sync: bool = False):
+    started = time.perf_counter()
+    try:
+        now = datetime.now()
+        row = (username, role, action, details, now.strftime("%Y-%m-%d %H:%M:%S"), int(now.timestamp()))
+        
+        if ASYNC_LOGGING and not sync and _log_writer.submit(row):
+            _log_action_seconds.observe(time.perf_counter() - started, mode="queued")
+            print(f"[LOG] Action queued: {username} ({role}) - {action}")
+            return
+        
+        _write_log_rows([row])
+        _log_action_seconds.observe(time.perf_counter() - started, mode="direct")
         print(f"[LOG] Action logged: {username} ({role}) - {action}")
         
     except Exception as e:
+        _log_action_seconds.observe(time.perf_counter() - started, mode="failed")
         print(f"[LOG ERROR] Failed to log action: {e}")
 
 
+@cacheable("logs")
 def get_logs(limit: int = 100):
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            SELECT * FROM logs
-            ORDER BY created_at DESC
-            LIMIT ?;
-            """,
-            (limit,),
-        )
+        flush_logs()
         
-        rows = cur.fetchall()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT * FROM logs
+                ORDER BY created_ts DESC, id DESC
+                LIMIT ?;
+                """,
+                (limit,),
+            )
+            rows = cur.fetchall()
         
         print(f"[LOG] Retrieved {len(rows)} log entries.")
         return rows
@@ -50,29 +244,28 @@ def get_logs(limit: int = 100):
         return []
 
 
-def export_logs_to_csv(filename: str = "audit_logs.csv") -> bool:
+def iter_logs_csv(compress: bool = False) -> Iterator[bytes]:
+    # Covers archived months too, newest first.
+    flush_logs()
+    rows = iter_all_log_rows(("id", "username", "role", "action", "details", "created_at"))
+    chunks = iter_csv(rows, LOG_EXPORT_HEADER)
+    yield from (iter_gzip(chunks) if compress else chunks)
+
+
+def export_logs_to_csv(filename: str = "audit_logs.csv", compress: bool = False) -> bool:
     try:
-        import csv
+        flush_logs()
         
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn:
+            has_logs = conn.execute("SELECT EXISTS (SELECT 1 FROM logs);").fetchone()[0]
         
-        cur.execute("SELECT * FROM logs ORDER BY created_at DESC;")
-        rows = cur.fetchall()
-        conn.close()
-        
-        if not rows:
+        if not has_logs and not list_archived_months():
             print("[LOG] No logs to export.")
             return False
         
-        with open(filename, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["ID", "Username", "Role", "Action", "Details", "Timestamp"])
-            for row in rows:
-                writer.writerow([row["id"], row["username"], row["role"], 
-                               row["action"], row["details"], row["created_at"]])
+        size = write_export(filename, iter_logs_csv(compress=compress))
         
-        print(f"[LOG] Logs exported to {filename}")
+        print(f"[LOG] Logs exported to {filename} ({size} bytes)")
         return True
         
     except Exception as e:
@@ -80,38 +273,97 @@ def export_logs_to_csv(filename: str = "audit_logs.csv") -> bool:
         return False
 
 
-def cleanup_old_data(retention_days: int = 90):
+def export_logs_to_parquet(filename: str = "audit_logs.parquet") -> bool:
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        cutoff_date = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        flush_logs()
         
-        cur.execute(
-            """
-            DELETE FROM logs
-            WHERE created_at < ?;
-            """,
-            (cutoff_date,)
+        rows = write_parquet(
+            filename,
+            iter_all_log_rows(("id", "username", "role", "action", "details", "created_ts"), descending=False),
+            LOG_PARQUET_COLUMNS,
         )
         
-        deleted_logs = cur.rowcount
+        print(f"[LOG] {rows} logs exported to {filename}")
+        return True
         
-        cur.execute(
-            """
-            DELETE FROM patients
-            WHERE created_at < ?;
-            """,
-            (cutoff_date,)
-        )
+    except Exception as e:
+        print(f"[LOG ERROR] Failed to export logs to Parquet: {e}")
+        return False
+
+
+def _delete_in_batches(table: str, cutoff_ts: int, batch_size: int, stats: dict) -> int:
+    deleted = 0
+    last_id = 0
+    while True:
+        # Find the batch's upper rowid without holding the write lock. NOT
+        # INDEXED keeps this a walk in rowid order from last_id, where the
+        # old rows sit.
+        with get_connection() as conn:
+            row = conn.execute(
+                f"SELECT id FROM {table} NOT INDEXED WHERE id > ? AND created_ts < ? ORDER BY id LIMIT 1 OFFSET ?;",
+                (last_id, cutoff_ts, batch_size - 1),
+            ).fetchone()
+        upper_id = row[0] if row else None
+
+        with get_connection() as conn:
+            hold_started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE;")
+            if upper_id is None:
+                cur = conn.execute(f"DELETE FROM {table} WHERE id > ? AND created_ts < ?;", (last_id, cutoff_ts))
+            else:
+                cur = conn.execute(
+                    f"DELETE FROM {table} WHERE id > ? AND id <= ? AND created_ts < ?;",
+                    (last_id, upper_id, cutoff_ts),
+                )
+            conn.commit()
+            stats["max_lock_hold"] = max(stats["max_lock_hold"], time.perf_counter() - hold_started)
+
+        stats["batches"] += 1
+        deleted += cur.rowcount
+        if cur.rowcount:
+            bump_data_version(table)
+        if upper_id is None:
+            return deleted
+        last_id = upper_id
+        # Let queued log writes and other writers in between batches.
+        time.sleep(CLEANUP_BATCH_PAUSE)
+
+
+def cleanup_old_data(retention_days: int = 90, batch_size: int = CLEANUP_BATCH_SIZE):
+    try:
+        flush_logs()
         
-        deleted_patients = cur.rowcount
+        cutoff_ts = int((datetime.now() - timedelta(days=retention_days)).timestamp())
+        started = time.perf_counter()
+        stats = {"batches": 0, "max_lock_hold": 0.0}
         
-        conn.commit()
-        conn.close()
+        deleted_logs = _delete_in_batches("logs", cutoff_ts, batch_size, stats)
+        deleted_logs += purge_log_archives(cutoff_ts)
+        deleted_patients = _delete_in_batches("patients", cutoff_ts, batch_size, stats)
+        elapsed = time.perf_counter() - started
+        
+        vacuum = incremental_vacuum()
+        if vacuum:
+            stats["max_lock_hold"] = max(stats["max_lock_hold"], vacuum["max_lock_hold"])
+        
+        rows_per_second = (deleted_logs + deleted_patients) / elapsed if elapsed else 0.0
+        print(
+            f"[RETENTION] Cleaned up {deleted_logs} old log entries and {deleted_patients} old patient records "
+            f"(older than {retention_days} days) in {stats['batches']} batches, {rows_per_second:.0f} rows/s, "
+            f"longest lock hold {stats['max_lock_hold'] * 1000:.1f} ms"
+        )
+        if vacuum:
+            print(f"[RETENTION] Incremental vacuum released {vacuum['pages_freed']} pages.")
         
-        print(f"[RETENTION] Cleaned up {deleted_logs} old log entries and {deleted_patients} old patient records (older than {retention_days} days)")
-        return {"logs_deleted": deleted_logs, "patients_deleted": deleted_patients}
+        return {
+            "logs_deleted": deleted_logs,
+            "patients_deleted": deleted_patients,
+            "batches": stats["batches"],
+            "seconds": elapsed,
+            "rows_per_second": rows_per_second,
+            "max_lock_hold": stats["max_lock_hold"],
+            "pages_freed": vacuum["pages_freed"] if vacuum else None,
+        }
         
     except Exception as e:
         print(f"[RETENTION ERROR] Failed to cleanup old data: {e}")
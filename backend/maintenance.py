@@ -0,0 +1,78 @@
+import argparse
+import sys
+from datetime import datetime
+
+from .auth import migrate_legacy_password_hashes
+from .db import apply_retention_policy, enable_incremental_vacuum, init_db
+from .incremental_backup import TIMESTAMP_FORMAT, restore_to_point_in_time
+from .log_archive import LOG_HOT_MONTHS, archive_old_logs
+from .patients import rebuild_diagnosis_stats
+
+
+def _rebuild_diagnosis_stats(args) -> int:
+    rebuild_diagnosis_stats()
+    return 0
+
+
+def _enable_incremental_vacuum(args) -> int:
+    enable_incremental_vacuum()
+    return 0
+
+
+def _migrate_password_hashes(args) -> int:
+    migrate_legacy_password_hashes()
+    return 0
+
+
+def _prune_backups(args) -> int:
+    deleted = apply_retention_policy()
+    print(f"[DB] Retention policy removed {len(deleted)} backup(s).")
+    return 0
+
+
+def _archive_logs(args) -> int:
+    result = archive_old_logs(hot_months=args.hot_months)
+    print(f"[LOG] Archived {result['rows']} log entries across {len(result['months'])} month(s).")
+    return 0
+
+
+def _add_archive_logs_arguments(parser) -> None:
+    parser.add_argument("--hot-months", type=int, default=LOG_HOT_MONTHS,
+                        help="Months (including the current one) kept in the hot logs table")
+
+
+def _restore_to(args) -> int:
+    return 0 if restore_to_point_in_time(datetime.strptime(args.at, TIMESTAMP_FORMAT)) else 1
+
+
+def _add_restore_to_arguments(parser) -> None:
+    parser.add_argument("--at", required=True, help='Target time, "YYYY-MM-DD HH:MM:SS"')
+
+
+# name -> (handler, help, optional function adding the command's arguments)
+COMMANDS = {
+    "rebuild-diagnosis-stats": (_rebuild_diagnosis_stats, "Recompute diagnosis_stats from the patients table", None),
+    "enable-incremental-vacuum": (_enable_incremental_vacuum, "Switch an existing database to auto_vacuum=INCREMENTAL (runs VACUUM)", None),
+    "migrate-password-hashes": (_migrate_password_hashes, "Wrap legacy SHA-256 password hashes in bcrypt", None),
+    "prune-backups": (_prune_backups, "Apply the grandfather-father-son backup retention policy", None),
+    "archive-logs": (_archive_logs, "Move logs older than the hot window into monthly archive files", _add_archive_logs_arguments),
+    "restore-to": (_restore_to, "Restore the database to an incremental backup point in time", _add_restore_to_arguments),
+}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.maintenance", description="HMS database maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, add_arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if add_arguments:
+            add_arguments(subparser)
+
+    args = parser.parse_args(argv)
+    init_db()
+    handler = COMMANDS[args.command][0]
+    return handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
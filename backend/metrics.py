@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+# Served at http://METRICS_HOST:METRICS_PORT/metrics in Prometheus text
+# format; set METRICS_PORT to None to disable. With METRICS_FILE set, the
+# same text is also written there every METRICS_FILE_INTERVAL seconds.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_FILE = None
+METRICS_FILE_INTERVAL = 15.0
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        try:
+            if len(labels) == len(self.label_names):
+                return tuple([str(labels[name]) for name in self.label_names])
+        except KeyError:
+            pass
+        raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            series["counts"][index] += 1
+            series["sum"] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self, **labels) -> dict:
+        # Cumulative buckets plus p50/p95/p99 estimates (the upper bound of
+        # the bucket holding that observation).
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            counts = list(series["counts"]) if series else [0] * (len(self.buckets) + 1)
+            total_sum = series["sum"] if series else 0.0
+        bounds = self.buckets + (float("inf"),)
+        cumulative, running = [], 0
+        for bound, count in zip(bounds, counts):
+            running += count
+            cumulative.append((bound, running))
+
+        def quantile(q):
+            if not running:
+                return None
+            return next(bound for bound, seen in cumulative if seen >= q * running)
+
+        return {"count": running, "sum": total_sum, "buckets": cumulative,
+                "p50": quantile(0.5), "p95": quantile(0.95), "p99": quantile(0.99)}
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((key, list(s["counts"]), s["sum"]) for key, s in self._values.items())
+        lines = self._header()
+        for key, counts, total_sum in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {running}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, labels: tuple, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels: tuple = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        # Called before each render, e.g. to copy pool stats into gauges.
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"[METRICS WARNING] Collector failed: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def write_metrics_file(path: str) -> None:
+    # Atomic, so a scraper reading the file never sees half a write.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_metrics())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporter_lock = threading.Lock()
+_server: Optional[ThreadingHTTPServer] = None
+_file_writer: Optional[threading.Thread] = None
+
+
+def _write_file_periodically(path: str, interval: float) -> None:
+    while True:
+        try:
+            write_metrics_file(path)
+        except OSError as e:
+            print(f"[METRICS WARNING] Could not write {path}: {e}")
+        time.sleep(interval)
+
+
+def start_metrics_exporter(port: Optional[int] = None, path: Optional[str] = None) -> bool:
+    # Idempotent per process. A port already in use (another app process)
+    # is reported and skipped rather than failing startup.
+    global _server, _file_writer
+    port = METRICS_PORT if port is None else port
+    path = METRICS_FILE if path is None else path
+    started = False
+    with _exporter_lock:
+        if port and _server is None:
+            try:
+                _server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+                _server.daemon_threads = True
+                threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+                print(f"[METRICS] Serving Prometheus metrics on http://{METRICS_HOST}:{port}/metrics")
+                started = True
+            except OSError as e:
+                print(f"[METRICS WARNING] Metrics endpoint not started on port {port}: {e}")
+        if path and _file_writer is None:
+            _file_writer = threading.Thread(target=_write_file_periodically, args=(path, METRICS_FILE_INTERVAL),
+                                            name="metrics-file", daemon=True)
+            _file_writer.start()
+            print(f"[METRICS] Writing Prometheus metrics to {path} every {METRICS_FILE_INTERVAL:.0f}s")
+            started = True
+    return started
+
+
+def get_metrics_endpoint() -> Optional[str]:
+    with _exporter_lock:
+        if _server is None:
+            return None
+        host, port = _server.server_address[:2]
+    return f"http://{host}:{port}/metrics"
+
+
+def stop_metrics_exporter() -> None:
+    global _server
+    with _exporter_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
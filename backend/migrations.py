@@ -0,0 +1,338 @@
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+
+def _create_base_tables(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('admin','doctor','receptionist')),
+            gdpr_consent INTEGER DEFAULT 0
+        );
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            contact TEXT,
+            diagnosis TEXT,
+            anonymized_name TEXT,
+            anonymized_contact TEXT,
+            encrypted_name TEXT,
+            encrypted_contact TEXT,
+            created_at TEXT
+        );
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            role TEXT,
+            action TEXT,
+            details TEXT,
+            created_at TEXT
+        );
+        """
+    )
+
+
+def _get_columns(cur: sqlite3.Cursor, table: str) -> set:
+    cur.execute(f"PRAGMA table_info({table});")
+    return {row[1] for row in cur.fetchall()}
+
+
+def _add_legacy_columns(cur: sqlite3.Cursor) -> None:
+    # Databases created before these columns existed; check instead of
+    # relying on ALTER TABLE failing.
+    legacy_columns = [
+        ("users", "gdpr_consent", "INTEGER DEFAULT 0"),
+        ("patients", "encrypted_name", "TEXT"),
+        ("patients", "encrypted_contact", "TEXT"),
+    ]
+    for table, column, column_type in legacy_columns:
+        if column not in _get_columns(cur, table):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+
+
+def _create_anonymization_runs(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS anonymization_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL CHECK(status IN ('running','completed')),
+            last_id INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT,
+            finished_at TEXT
+        );
+        """
+    )
+
+
+def _add_anonymization_dirty_flag(cur: sqlite3.Cursor) -> None:
+    if "anonymization_dirty" not in _get_columns(cur, "patients"):
+        # New rows default to dirty. Existing rows are all marked dirty once,
+        # since we cannot tell whether their encrypted copies are current.
+        cur.execute("ALTER TABLE patients ADD COLUMN anonymization_dirty INTEGER NOT NULL DEFAULT 1;")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_dirty ON patients(id) WHERE anonymization_dirty = 1;")
+
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_mark_dirty
+        AFTER UPDATE OF name, contact, anonymized_name, encrypted_name, encrypted_contact ON patients
+        WHEN NEW.name IS NOT OLD.name
+          OR NEW.contact IS NOT OLD.contact
+          OR (NEW.name IS NOT NULL AND (NEW.anonymized_name IS NULL OR NEW.encrypted_name IS NULL))
+          OR (NEW.contact IS NOT NULL AND NEW.encrypted_contact IS NULL)
+        BEGIN
+            UPDATE patients SET anonymization_dirty = 1 WHERE id = NEW.id;
+        END;
+        """
+    )
+
+
+def _add_epoch_timestamps_and_indexes(cur: sqlite3.Cursor) -> None:
+    # created_at stays for display; created_ts is what range queries and
+    # ORDER BY use. The 'utc' modifier reads created_at as local time, which
+    # matches datetime.now().timestamp() on the Python side.
+    for table in ("logs", "patients"):
+        if "created_ts" not in _get_columns(cur, table):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN created_ts INTEGER;")
+        cur.execute(
+            f"""
+            UPDATE {table} SET created_ts = CAST(strftime('%s', created_at, 'utc') AS INTEGER)
+            WHERE created_ts IS NULL AND created_at IS NOT NULL;
+            """
+        )
+        # Safety net for writers that only set created_at.
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_created_ts
+            AFTER INSERT ON {table}
+            WHEN NEW.created_ts IS NULL AND NEW.created_at IS NOT NULL
+            BEGIN
+                UPDATE {table} SET created_ts = CAST(strftime('%s', NEW.created_at, 'utc') AS INTEGER)
+                WHERE id = NEW.id;
+            END;
+            """
+        )
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_created_ts ON logs(created_ts);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_username_ts ON logs(username, created_ts);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_action_ts ON logs(action, created_ts);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_created_ts ON patients(created_ts);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_patients_diagnosis ON patients(diagnosis);")
+    cur.execute("ANALYZE logs;")
+    cur.execute("ANALYZE patients;")
+
+
+DIAGNOSIS_STATS_REBUILD_SQL = (
+    "DELETE FROM diagnosis_stats;",
+    """
+    INSERT INTO diagnosis_stats (diagnosis, patient_count)
+    SELECT COALESCE(diagnosis, ''), COUNT(*) FROM patients GROUP BY COALESCE(diagnosis, '');
+    """,
+)
+
+
+def _create_diagnosis_stats(cur: sqlite3.Cursor) -> None:
+    # NULL diagnoses are folded into '' so every group has a usable key.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS diagnosis_stats (
+            diagnosis TEXT PRIMARY KEY NOT NULL,
+            patient_count INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_stats_insert
+        AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO diagnosis_stats (diagnosis, patient_count)
+            VALUES (COALESCE(NEW.diagnosis, ''), 1)
+            ON CONFLICT(diagnosis) DO UPDATE SET patient_count = patient_count + 1;
+        END;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_stats_delete
+        AFTER DELETE ON patients
+        BEGIN
+            UPDATE diagnosis_stats SET patient_count = patient_count - 1
+            WHERE diagnosis = COALESCE(OLD.diagnosis, '');
+            DELETE FROM diagnosis_stats
+            WHERE diagnosis = COALESCE(OLD.diagnosis, '') AND patient_count <= 0;
+        END;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_patients_stats_update
+        AFTER UPDATE OF diagnosis ON patients
+        WHEN COALESCE(OLD.diagnosis, '') <> COALESCE(NEW.diagnosis, '')
+        BEGIN
+            UPDATE diagnosis_stats SET patient_count = patient_count - 1
+            WHERE diagnosis = COALESCE(OLD.diagnosis, '');
+            DELETE FROM diagnosis_stats
+            WHERE diagnosis = COALESCE(OLD.diagnosis, '') AND patient_count <= 0;
+            INSERT INTO diagnosis_stats (diagnosis, patient_count)
+            VALUES (COALESCE(NEW.diagnosis, ''), 1)
+            ON CONFLICT(diagnosis) DO UPDATE SET patient_count = patient_count + 1;
+        END;
+        """
+    )
+
+    for statement in DIAGNOSIS_STATS_REBUILD_SQL:
+        cur.execute(statement)
+
+
+def _create_log_archive_months(cur: sqlite3.Cursor) -> None:
+    # One row per month of logs moved out to its own archive file, so
+    # spanning queries and retention never list the archive directory.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_archive_months (
+            month TEXT PRIMARY KEY,
+            file TEXT NOT NULL,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            min_ts INTEGER,
+            max_ts INTEGER,
+            archived_at TEXT
+        );
+        """
+    )
+
+
+# External-content FTS5 index over logs.action/details plus the triggers
+# that keep it in step. {schema} lets the per-month archive files carry the
+# same index; trigger bodies resolve tables in the trigger's own schema.
+LOGS_FTS_SQL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.logs_fts USING fts5(
+        action, details, content='logs', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='3'
+    );
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.trg_logs_fts_insert
+    AFTER INSERT ON logs
+    BEGIN
+        INSERT INTO logs_fts (rowid, action, details) VALUES (NEW.id, NEW.action, NEW.details);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.trg_logs_fts_delete
+    AFTER DELETE ON logs
+    BEGIN
+        INSERT INTO logs_fts (logs_fts, rowid, action, details) VALUES ('delete', OLD.id, OLD.action, OLD.details);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.trg_logs_fts_update
+    AFTER UPDATE OF action, details ON logs
+    BEGIN
+        INSERT INTO logs_fts (logs_fts, rowid, action, details) VALUES ('delete', OLD.id, OLD.action, OLD.details);
+        INSERT INTO logs_fts (rowid, action, details) VALUES (NEW.id, NEW.action, NEW.details);
+    END;
+    """,
+)
+LOGS_FTS_REBUILD_SQL = "INSERT INTO {schema}.logs_fts (logs_fts) VALUES ('rebuild');"
+
+
+def _create_logs_fts(cur: sqlite3.Cursor) -> None:
+    # Builds without FTS5 skip the index; log search then falls back to LIKE.
+    try:
+        cur.execute("SAVEPOINT logs_fts;")
+        for statement in LOGS_FTS_SQL:
+            cur.execute(statement.format(schema="main"))
+        cur.execute(LOGS_FTS_REBUILD_SQL.format(schema="main"))
+        cur.execute("RELEASE logs_fts;")
+    except sqlite3.OperationalError as e:
+        cur.execute("ROLLBACK TO logs_fts;")
+        cur.execute("RELEASE logs_fts;")
+        print(f"[DB WARNING] Full-text log search unavailable: {e}")
+
+
+# Ordered, append-only. Never edit a step that has shipped; add a new one.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "Create users, patients and logs tables", _create_base_tables),
+    (2, "Add gdpr_consent and encrypted_* columns to legacy tables", _add_legacy_columns),
+    (3, "Track resumable bulk anonymization runs", _create_anonymization_runs),
+    (4, "Flag patients needing anonymization via triggers", _add_anonymization_dirty_flag),
+    (5, "Add epoch created_ts columns and hot-query indexes", _add_epoch_timestamps_and_indexes),
+    (6, "Materialize per-diagnosis patient counts", _create_diagnosis_stats),
+    (7, "Index per-month audit log archive files", _create_log_archive_months),
+    (8, "Full-text index over log actions and details", _create_logs_fts),
+]
+
+
+def ensure_schema_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        );
+        """
+    )
+    conn.commit()
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version;").fetchone()
+    return row[0] or 0
+
+
+def get_pending_migrations(conn: sqlite3.Connection) -> list:
+    current = get_schema_version(conn)
+    return [m for m in MIGRATIONS if m[0] > current]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> List[int]:
+    ensure_schema_version_table(conn)
+
+    applied = []
+    if not get_pending_migrations(conn):
+        return applied
+
+    for version, description, step in MIGRATIONS:
+        cur = conn.cursor()
+        # IMMEDIATE takes the write lock up front so two processes starting
+        # together cannot both apply the same step.
+        cur.execute("BEGIN IMMEDIATE;")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+
+            step(cur)
+            cur.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?);",
+                (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"[DB ERROR] Migration {version} ({description}) failed: {e}")
+            raise
+
+        applied.append(version)
+        print(f"[DB] Applied migration {version}: {description}")
+
+    return applied
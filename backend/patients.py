@@ -0,0 +1,157 @@
+from typing import Iterator, Optional, Sequence
+from .cache import bump_data_version, cacheable
+from .db import get_connection
+from .exports import iter_query_csv, iter_query_rows, write_parquet
+from .migrations import DIAGNOSIS_STATS_REBUILD_SQL
+
+PATIENT_COLUMNS = (
+    "id", "name", "contact", "diagnosis", "anonymized_name", "anonymized_contact",
+    "encrypted_name", "encrypted_contact", "created_at",
+)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Date-filtered counts stop here and are reported as a lower bound.
+EXACT_COUNT_LIMIT = 10000
+# Analytics exports carry the anonymized identifiers only, never name/contact.
+PATIENT_PARQUET_COLUMNS = (
+    ("id", "int"), ("anonymized_name", "str"), ("anonymized_contact", "str"),
+    ("diagnosis", "dict"), ("created_at", "timestamp"),
+)
+
+
+def _build_filters(diagnosis: Optional[str], date_from: Optional[int], date_to: Optional[int]) -> tuple:
+    clauses, params = [], []
+    if diagnosis:
+        clauses.append("diagnosis = ?")
+        params.append(diagnosis)
+    if date_from is not None:
+        clauses.append("created_ts >= ?")
+        params.append(date_from)
+    if date_to is not None:
+        clauses.append("created_ts <= ?")
+        params.append(date_to)
+    return clauses, params
+
+
+def _estimate_total(cur, clauses: list, params: list, diagnosis: Optional[str] = None) -> tuple:
+    # diagnosis_stats answers the unfiltered and diagnosis-only totals exactly.
+    if not clauses:
+        cur.execute("SELECT COALESCE(SUM(patient_count), 0) FROM diagnosis_stats;")
+        return cur.fetchone()[0], "exact"
+    if diagnosis and len(clauses) == 1:
+        cur.execute("SELECT COALESCE(SUM(patient_count), 0) FROM diagnosis_stats WHERE diagnosis = ?;", (diagnosis,))
+        return cur.fetchone()[0], "exact"
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    cur.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM patients {where} LIMIT ?);", (*params, EXACT_COUNT_LIMIT + 1))
+    count = cur.fetchone()[0]
+    if count <= EXACT_COUNT_LIMIT:
+        return count, "exact"
+
+    return EXACT_COUNT_LIMIT, "lower_bound"
+
+
+@cacheable("patients")
+def get_patients_page(columns: Sequence[str] = PATIENT_COLUMNS, page_size: int = DEFAULT_PAGE_SIZE,
+                      after_id: Optional[int] = None, descending: bool = False,
+                      diagnosis: Optional[str] = None, date_from: Optional[int] = None,
+                      date_to: Optional[int] = None) -> dict:
+    unknown = [c for c in columns if c not in PATIENT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown patient columns: {unknown}")
+
+    selected = list(columns) if "id" in columns else ["id", *columns]
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+    clauses, params = _build_filters(diagnosis, date_from, date_to)
+    page_clauses, page_params = list(clauses), list(params)
+    if after_id is not None:
+        page_clauses.append("id < ?" if descending else "id > ?")
+        page_params.append(after_id)
+
+    where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ""
+    order = "DESC" if descending else "ASC"
+
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            # Fetch one extra row to learn whether another page exists.
+            cur.execute(
+                f"SELECT {', '.join(selected)} FROM patients {where} ORDER BY id {order} LIMIT ?;",
+                (*page_params, page_size + 1),
+            )
+            rows = cur.fetchall()
+            total, total_kind = _estimate_total(cur, clauses, params, diagnosis)
+
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return {
+            "rows": rows,
+            "next_cursor": rows[-1]["id"] if has_more and rows else None,
+            "has_more": has_more,
+            "estimated_total": total,
+            "total_kind": total_kind,
+        }
+
+    except Exception as e:
+        print(f"[PATIENTS ERROR] Failed to load patient page: {e}")
+        raise
+
+
+def iter_patients_csv(compress: bool = False) -> Iterator[bytes]:
+    yield from iter_query_csv("SELECT * FROM patients ORDER BY id;", compress=compress)
+
+
+def export_patients_to_parquet(filename: str = "patients.parquet") -> bool:
+    try:
+        rows = write_parquet(
+            filename,
+            iter_query_rows(
+                "SELECT id, anonymized_name, anonymized_contact, diagnosis, created_ts FROM patients ORDER BY id;",
+                include_header=False,
+            ),
+            PATIENT_PARQUET_COLUMNS,
+        )
+        print(f"[PATIENTS] {rows} patients exported to {filename}")
+        return True
+
+    except Exception as e:
+        print(f"[PATIENTS ERROR] Failed to export patients to Parquet: {e}")
+        return False
+
+
+@cacheable("patients")
+def get_diagnosis_stats() -> tuple:
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT diagnosis, patient_count FROM diagnosis_stats ORDER BY diagnosis;")
+            rows = cur.fetchall()
+
+        total = sum(row["patient_count"] for row in rows)
+        return total, [(row["diagnosis"], row["patient_count"]) for row in rows]
+
+    except Exception as e:
+        print(f"[PATIENTS ERROR] Failed to load diagnosis stats: {e}")
+        raise
+
+
+def rebuild_diagnosis_stats() -> int:
+    try:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE;")
+            for statement in DIAGNOSIS_STATS_REBUILD_SQL:
+                cur.execute(statement)
+            conn.commit()
+            cur.execute("SELECT COUNT(*) FROM diagnosis_stats;")
+            groups = cur.fetchone()[0]
+
+        bump_data_version("patients")
+
+        print(f"[PATIENTS] Rebuilt diagnosis stats: {groups} diagnosis groups.")
+        return groups
+
+    except Exception as e:
+        print(f"[PATIENTS ERROR] Failed to rebuild diagnosis stats: {e}")
+        raise
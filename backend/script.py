@@ -1,41 +1,245 @@
-import sqlite3
-from datetime import datetime
-from backend.db import get_connection
-
-# Define 10 new patients with unique diseases
-new_patients = [
-    {"name": "Aisha Khan", "contact": "0300-111-0001", "diagnosis": "Migraine"},
-    {"name": "Bilal Riaz", "contact": "0300-111-0002", "diagnosis": "Diabetes"},
-    {"name": "Hina Shah", "contact": "0300-111-0003", "diagnosis": "Asthma"},
-    {"name": "Omar Siddiqui", "contact": "0300-111-0004", "diagnosis": "Allergic Rhinitis"},
-    {"name": "Sania Malik", "contact": "0300-111-0005", "diagnosis": "Diabetes"},
-    {"name": "Fahad Iqbal", "contact": "0300-111-0006", "diagnosis": "Arthritis"},
-    {"name": "Kiran Ali", "contact": "0300-111-0007", "diagnosis": "Diabetes"},
-    {"name": "Usman Tariq", "contact": "0300-111-0008", "diagnosis": "Migraine"},
-    {"name": "Zoya Hassan", "contact": "0300-111-0009", "diagnosis": "Hyperthyroidism"},
-    {"name": "Danish Nawaz", "contact": "0300-111-0010", "diagnosis": "Anemia"},
-]
-
-# Connect to database
-conn = get_connection()
-cur = conn.cursor()
-
-# Delete all existing patients
-cur.execute("DELETE FROM patients;")
-conn.commit()
-print("[INFO] All existing patients deleted.")
-
-# Insert new patients
-current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-for patient in new_patients:
-    cur.execute(
-        """
-        INSERT INTO patients (name, contact, diagnosis, created_at)
-        VALUES (?, ?, ?, ?)
-        """,
-        (patient["name"], patient["contact"], patient["diagnosis"], current_time)
+"""Seeded synthetic patients and audit logs for load tests and benchmarks."""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from . import data_protection
+from .db import get_connection, init_db
+from .migrations import LOGS_FTS_REBUILD_SQL, LOGS_FTS_SQL
+
+GENERATOR_BATCH_SIZE = 10_000
+GENERATOR_COMMIT_EVERY = 200_000
+GENERATOR_WORKERS = min(8, os.cpu_count() or 1)
+
+DEFAULT_DIAGNOSES = {
+    "Flu": 20, "Hypertension": 15, "Diabetes": 12, "Asthma": 8, "Migraine": 8,
+    "Allergic Rhinitis": 7, "Arthritis": 6, "Anemia": 6, "Covid-19": 5, "Fracture": 5,
+    "Hyperthyroidism": 4, "Pneumonia": 4,
+}
+FIRST_NAMES = (
+    "Aisha", "Bilal", "Hina", "Omar", "Sania", "Fahad", "Kiran", "Usman", "Zoya", "Danish",
+    "Ayesha", "Hamza", "Mariam", "Ali", "Fatima", "Ahmed", "Sara", "Hassan", "Noor", "Imran",
+)
+LAST_NAMES = (
+    "Khan", "Riaz", "Shah", "Siddiqui", "Malik", "Iqbal", "Ali", "Tariq", "Hassan", "Nawaz",
+    "Qureshi", "Butt", "Chaudhry", "Sheikh", "Mirza", "Raza", "Javed", "Aslam", "Anwar", "Baig",
+)
+LOG_USERS = (("admin", "admin"), ("doctor", "doctor"), ("reception", "receptionist"))
+LOG_ACTIONS = {
+    "view_patients": 40, "login": 15, "logout": 12, "add_patient": 10, "view_patient": 10,
+    "login_failed": 5, "anonymize_patient": 4, "export_logs": 2, "backup_created": 2,
+}
+
+PATIENT_INSERT = (
+    "INSERT INTO patients (id, name, contact, diagnosis, created_at, created_ts, "
+    "anonymized_name, anonymized_contact, encrypted_name, encrypted_contact, anonymization_dirty) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
+)
+LOG_INSERT = (
+    "INSERT INTO logs (username, role, action, details, created_at, created_ts) VALUES (?, ?, ?, ?, ?, ?);"
+)
+
+
+def parse_distribution(text: str) -> dict:
+    # "Flu=30,Diabetes=20" -> {"Flu": 30.0, "Diabetes": 20.0}
+    distribution = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if not name.strip():
+            continue
+        distribution[name.strip()] = float(weight) if weight else 1.0
+    if not distribution or any(w < 0 for w in distribution.values()) or not sum(distribution.values()):
+        raise ValueError(f"Invalid distribution: {text!r}")
+    return distribution
+
+
+def _timestamp(index: int, total: int, start_ts: int, end_ts: int, rng: random.Random) -> int:
+    # Timestamps rise with the row index, as they would in a live system,
+    # so id order and time order agree.
+    return start_ts + int((index + rng.random()) * (end_ts - start_ts) / max(total, 1))
+
+
+# Each batch seeds its own RNG from the seed and its first row index, so the
+# same arguments (batch size included) give the same rows at any --workers.
+def _patient_batch(spec: dict) -> list:
+    rng = random.Random(f"{spec['seed']}:patients:{spec['first_index']}")
+    names, weights = zip(*spec["diagnoses"].items())
+    diagnoses = rng.choices(names, weights, k=spec["count"])
+    rows = []
+    for offset, diagnosis in enumerate(diagnoses):
+        index = spec["first_index"] + offset
+        patient_id = spec["first_id"] + index
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        contact = f"03{rng.randint(0, 49):02d}-{rng.randint(0, 9999999):07d}"
+        ts = _timestamp(index, spec["total"], spec["start_ts"], spec["end_ts"], rng)
+        created_at = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+        if spec["anonymize"]:
+            protected = (
+                data_protection.anonymize_name(name, patient_id),
+                data_protection.anonymize_contact(contact),
+                data_protection.encrypt_data(name),
+                data_protection.encrypt_data(contact),
+                0,
+            )
+        else:
+            protected = (None, None, None, None, 1)
+        rows.append((patient_id, name, contact, diagnosis, created_at, ts, *protected))
+    return rows
+
+
+def _log_batch(spec: dict) -> list:
+    rng = random.Random(f"{spec['seed']}:logs:{spec['first_index']}")
+    actions, weights = zip(*LOG_ACTIONS.items())
+    rows = []
+    for offset, action in enumerate(rng.choices(actions, weights, k=spec["count"])):
+        index = spec["first_index"] + offset
+        username, role = rng.choice(LOG_USERS)
+        details = f"patient_id={rng.randint(1, spec['patient_ids'])}" if spec["patient_ids"] else ""
+        ts = _timestamp(index, spec["total"], spec["start_ts"], spec["end_ts"], rng)
+        rows.append((username, role, action, details, datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), ts))
+    return rows
+
+
+def _init_worker(key_file: str) -> None:
+    data_protection.ENCRYPTION_KEY_FILE = key_file
+
+
+def _iter_batches(build, specs, workers: int):
+    # Batches come back in order; only a few are in flight at a time so
+    # memory stays flat however many rows are generated.
+    if workers <= 1:
+        for spec in specs:
+            yield build(spec)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data_protection.ENCRYPTION_KEY_FILE,)) as pool:
+        in_flight = deque()
+        for spec in specs:
+            in_flight.append(pool.submit(build, spec))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def _specs(total: int, batch_size: int, **common):
+    for first_index in range(0, total, batch_size):
+        yield dict(common, first_index=first_index, count=min(batch_size, total - first_index), total=total)
+
+
+def _stream(sql: str, batches, commit_every: int) -> int:
+    written = pending = 0
+    with get_connection() as conn:
+        for rows in batches:
+            conn.executemany(sql, rows)
+            written += len(rows)
+            pending += len(rows)
+            if pending >= commit_every:
+                conn.commit()
+                pending = 0
+                print(f"[GENERATOR] {written} rows written")
+        conn.commit()
+    return written
+
+
+def _suspend_log_index():
+    # Per-row FTS trigger work dominates a bulk log load; one rebuild at the
+    # end indexes every row, including any written meanwhile by the app.
+    with get_connection() as conn:
+        has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'logs_fts';").fetchone()
+        if has_index:
+            conn.execute("DROP TRIGGER IF EXISTS trg_logs_fts_insert;")
+            conn.commit()
+    return bool(has_index)
+
+
+def _restore_log_index() -> None:
+    with get_connection() as conn:
+        for statement in LOGS_FTS_SQL:
+            conn.execute(statement.format(schema="main"))
+        conn.execute(LOGS_FTS_REBUILD_SQL.format(schema="main"))
+        conn.commit()
+
+
+def generate(patients: int = 10, logs: int = 0, seed: int = 42, diagnoses: dict = None, days: int = 365,
+             end: datetime = None, anonymize: bool = False, workers: int = GENERATOR_WORKERS,
+             batch_size: int = GENERATOR_BATCH_SIZE, commit_every: int = GENERATOR_COMMIT_EVERY,
+             reset: bool = False) -> dict:
+    end = end or datetime.now()
+    start_ts, end_ts = int((end - timedelta(days=days)).timestamp()), int(end.timestamp())
+    started = time.perf_counter()
+    if anonymize:
+        # Create (or load) the key before any worker starts, so workers only
+        # ever read an existing, complete key file.
+        data_protection.get_cipher()
+
+    with get_connection() as conn:
+        if reset:
+            conn.execute("DELETE FROM patients;")
+            conn.execute("DELETE FROM logs;")
+            conn.commit()
+            print("[GENERATOR] Existing patients and logs deleted.")
+        # Ids are assigned up front so anonymized names can be built off-process.
+        first_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM patients;").fetchone()[0]) + 1
+
+    common = {"seed": seed, "start_ts": start_ts, "end_ts": end_ts}
+    written_patients = _stream(
+        PATIENT_INSERT,
+        _iter_batches(_patient_batch, _specs(patients, batch_size, first_id=first_id, anonymize=anonymize,
+                                             diagnoses=diagnoses or DEFAULT_DIAGNOSES, **common), workers),
+        commit_every,
     )
 
-conn.commit()
-conn.close()
-print("[INFO] 10 new patients added successfully.")
+    written_logs = 0
+    if logs:
+        suspended = _suspend_log_index()
+        try:
+            written_logs = _stream(
+                LOG_INSERT,
+                _iter_batches(_log_batch, _specs(logs, batch_size, patient_ids=first_id - 1 + patients, **common),
+                              workers),
+                commit_every,
+            )
+        finally:
+            if suspended:
+                _restore_log_index()
+
+    elapsed = time.perf_counter() - started
+    rate = (written_patients + written_logs) / elapsed if elapsed else 0.0
+    print(f"[GENERATOR] {written_patients} patients and {written_logs} log rows in {elapsed:.1f}s ({rate:.0f} rows/s)")
+    return {"patients": written_patients, "logs": written_logs, "seconds": elapsed, "rows_per_second": rate}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.script", description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=10, help="Patients to generate")
+    parser.add_argument("--logs", type=int, default=0, help="Audit log rows to generate")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--diagnoses", type=parse_distribution, default=None,
+                        help='Weighted diagnoses, e.g. "Flu=30,Diabetes=20,Asthma=5"')
+    parser.add_argument("--days", type=int, default=365, help="Spread created timestamps over this many days")
+    parser.add_argument("--end", type=lambda s: datetime.strptime(s, "%Y-%m-%d"), default=None,
+                        help="Last day of the spread, YYYY-MM-DD (default: now)")
+    parser.add_argument("--anonymize", action="store_true",
+                        help="Fill anonymized and encrypted columns during generation")
+    parser.add_argument("--workers", type=int, default=GENERATOR_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=GENERATOR_BATCH_SIZE)
+    parser.add_argument("--commit-every", type=int, default=GENERATOR_COMMIT_EVERY)
+    parser.add_argument("--reset", action="store_true", help="Delete existing patients and logs first")
+    args = parser.parse_args(argv)
+
+    init_db()
+    generate(patients=args.patients, logs=args.logs, seed=args.seed, diagnoses=args.diagnoses,
+             days=args.days, end=args.end, anonymize=args.anonymize, workers=args.workers,
+             batch_size=args.batch_size, commit_every=args.commit_every, reset=args.reset)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
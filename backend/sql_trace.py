@@ -0,0 +1,299 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from datetime import datetime
+from typing import Optional
+
+from .metrics import REGISTRY, Histogram
+
+# Every pooled connection is opened with TracingConnection, whose cursors
+# time each statement (execute plus all fetches) and count the rows it
+# returned or changed.
+SQL_TRACE_ENABLED = True
+SQL_TRACE_BUFFER_SIZE = 2000
+SQL_TRACE_MAX_STATEMENTS = 500
+SLOW_QUERY_THRESHOLD = 0.1  # seconds
+SLOW_QUERY_BUFFER_SIZE = 200
+SLOW_QUERY_LOG = os.path.join(os.path.dirname(__file__), "..", "data", "slow_queries.log")
+SQL_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Frames from these files are plumbing, not the caller worth reporting.
+_SKIP_FILES = (__file__, os.path.join("backend", "db.py"), os.path.join("backend", "exports.py"), "contextlib.py")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+_local = threading.local()
+
+# All traced statements by view; per-statement latency is on the
+# diagnostics page, where the statement text is not a label.
+_statement_seconds = REGISTRY.histogram("hms_sql_statement_seconds", "Traced SQL statement time by view.",
+                                        ("view",), buckets=SQL_LATENCY_BUCKETS)
+
+
+def set_current_view(name: Optional[str]) -> None:
+    # Statements run on this thread (a Streamlit script run) are attributed
+    # to `name` until it is changed.
+    _local.view = name
+
+
+def get_current_view() -> Optional[str]:
+    return getattr(_local, "view", None)
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    # Literals folded to ? so one statement shape is one row in the summary.
+    return _SPACES.sub(" ", _LITERALS.sub("?", sql)).strip().rstrip(";")
+
+
+def _caller() -> str:
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not filename.endswith(_SKIP_FILES):
+            module = frame.f_globals.get("__name__", "?")
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class SqlTraceRecorder:
+    def __init__(self, buffer_size: int = SQL_TRACE_BUFFER_SIZE, max_statements: int = SQL_TRACE_MAX_STATEMENTS,
+                 slow_threshold: float = SLOW_QUERY_THRESHOLD):
+        self.slow_threshold = slow_threshold
+        self.max_statements = max_statements
+        self._recent = deque(maxlen=buffer_size)
+        self._slow = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+        # fingerprint -> {"count", "total", "max", "rows", "latency", "callers"}; all-time, LRU-bounded.
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def record(self, sql: str, seconds: float, rows: int, caller: str) -> None:
+        key = fingerprint(sql)
+        view = get_current_view()
+        entry = (time.time(), key, seconds, rows, caller, view)
+        _statement_seconds.observe(seconds, view=view or "-")
+        with self._lock:
+            self._recent.append(entry)
+            stats = self._statements.pop(key, None) or {
+                "count": 0, "total": 0.0, "max": 0.0, "rows": 0, "callers": {},
+                "latency": Histogram("statement", "", buckets=SQL_LATENCY_BUCKETS),
+            }
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["rows"] += rows
+            stats["latency"].observe(seconds)
+            stats["callers"][caller] = stats["callers"].get(caller, 0) + 1
+            self._statements[key] = stats
+            while len(self._statements) > self.max_statements:
+                self._statements.popitem(last=False)
+            if seconds >= self.slow_threshold:
+                self._slow.append(entry)
+
+        if seconds >= self.slow_threshold:
+            self._log_slow(entry, sql)
+
+    def _log_slow(self, entry: tuple, sql: str) -> None:
+        ts, _, seconds, rows, caller, view = entry
+        line = (
+            f"{datetime.fromtimestamp(ts):%Y-%m-%d %H:%M:%S} {seconds * 1000:.1f} ms rows={rows} "
+            f"caller={caller} view={view or '-'} sql={_SPACES.sub(' ', sql).strip()}\n"
+        )
+        print(f"[DB SLOW] {line.rstrip()}")
+        try:
+            with self._log_lock:
+                os.makedirs(os.path.dirname(SLOW_QUERY_LOG), exist_ok=True)
+                with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"[DB WARNING] Could not write slow query log: {e}")
+
+    def summary(self, limit: int = 50) -> list:
+        # Per statement: all-time totals plus exact percentiles over the
+        # recent window, heaviest total time first.
+        with self._lock:
+            recent = list(self._recent)
+            statements = {key: dict(stats, callers=dict(stats["callers"]), latency=stats["latency"].snapshot())
+                          for key, stats in self._statements.items()}
+
+        windows = {}
+        for _, key, seconds, _, _, _ in recent:
+            windows.setdefault(key, []).append(seconds)
+
+        rows = []
+        for key, stats in statements.items():
+            window = sorted(windows.get(key, ()))
+            pick = lambda q: window[min(len(window) - 1, int(len(window) * q))] if window else None
+            rows.append({
+                "statement": key,
+                "count": stats["count"],
+                "total_seconds": stats["total"],
+                "mean_ms": stats["total"] / stats["count"] * 1000,
+                "max_ms": stats["max"] * 1000,
+                "avg_rows": stats["rows"] / stats["count"],
+                "p50_ms": pick(0.5) * 1000 if window else None,
+                "p95_ms": pick(0.95) * 1000 if window else None,
+                "p99_ms": pick(0.99) * 1000 if window else None,
+                # Per bucket, not cumulative, so they can be summed across statements.
+                "buckets": [(bound, seen - previous) for (bound, seen), previous
+                            in zip(stats["latency"]["buckets"], [0] + [n for _, n in stats["latency"]["buckets"]])],
+                "top_caller": max(stats["callers"], key=stats["callers"].get),
+            })
+        rows.sort(key=lambda r: r["total_seconds"], reverse=True)
+        return rows[:limit]
+
+    def recent(self, limit: int = 100) -> list:
+        with self._lock:
+            entries = list(self._recent)[-limit:]
+        return [self._as_dict(e) for e in reversed(entries)]
+
+    def slow_queries(self) -> list:
+        with self._lock:
+            entries = list(self._slow)
+        return [self._as_dict(e) for e in reversed(entries)]
+
+    @staticmethod
+    def _as_dict(entry: tuple) -> dict:
+        ts, key, seconds, rows, caller, view = entry
+        return {"time": datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), "statement": key,
+                "ms": seconds * 1000, "rows": rows, "caller": caller, "view": view}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._recent.clear()
+            self._slow.clear()
+            self._statements.clear()
+
+
+_recorder = SqlTraceRecorder()
+
+
+class TracingCursor(sqlite3.Cursor):
+    # A statement's clock runs from execute() through every fetch; it is
+    # recorded once the result set is exhausted, the cursor is reused or
+    # closed, or the cursor is dropped.
+    _trace = None
+
+    def _finish(self) -> None:
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            _recorder.record(*trace)
+
+    def _start(self, method, sql, *args):
+        self._finish()
+        if not SQL_TRACE_ENABLED:
+            return method(self, sql, *args)
+        caller = _caller()
+        started = time.perf_counter()
+        try:
+            result = method(self, sql, *args)
+        except Exception:
+            _recorder.record(sql, time.perf_counter() - started, 0, caller)
+            raise
+        elapsed = time.perf_counter() - started
+        if self.description is None:
+            # DML/DDL: done once executed; rowcount is the rows changed.
+            _recorder.record(sql, elapsed, max(self.rowcount, 0), caller)
+        else:
+            self._trace = [sql, elapsed, 0, caller]
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._start(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._start(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._start(sqlite3.Cursor.executescript, sql_script)
+
+    def _timed_fetch(self, method, *args):
+        if self._trace is None:
+            return method(self, *args)
+        started = time.perf_counter()
+        result = method(self, *args)
+        self._trace[1] += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(sqlite3.Cursor.fetchone)
+        if self._trace is not None:
+            if row is None:
+                self._finish()
+            else:
+                self._trace[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed_fetch(sqlite3.Cursor.fetchmany, self.arraysize if size is None else size)
+        if self._trace is not None:
+            self._trace[2] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(sqlite3.Cursor.fetchall)
+        if self._trace is not None:
+            self._trace[2] += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed_fetch(sqlite3.Cursor.__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._trace is not None:
+            self._trace[2] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TracingConnection(sqlite3.Connection):
+    # Connection.execute() and friends build their cursor in C without
+    # calling cursor(), so they are routed through a TracingCursor here.
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def get_sql_summary(limit: int = 50) -> list:
+    return _recorder.summary(limit)
+
+
+def get_recent_statements(limit: int = 100) -> list:
+    return _recorder.recent(limit)
+
+
+def get_slow_queries() -> list:
+    return _recorder.slow_queries()
+
+
+def reset_sql_trace() -> None:
+    _recorder.reset()
@@ -0,0 +1,59 @@
+"""Per-value encrypt/decrypt cost: legacy per-call key load vs cached key ring.
+
+Run from the project root:
+    python -m benchmarks.bench_crypto [iterations]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+from backend import data_protection
+
+
+def _legacy_encrypt(plaintext: str) -> str:
+    # What encrypt_data did before the key ring: read the key file and
+    # build a new Fernet for every value.
+    key = data_protection.get_or_create_encryption_key()
+    return Fernet(key).encrypt(plaintext.encode("utf-8")).decode("utf-8")
+
+
+def _legacy_decrypt(token: str) -> str:
+    key = data_protection.get_or_create_encryption_key()
+    return Fernet(key).decrypt(token.encode("utf-8")).decode("utf-8")
+
+
+def _time_per_value(fn, values) -> float:
+    started = time.perf_counter()
+    for value in values:
+        fn(value)
+    return (time.perf_counter() - started) / len(values) * 1e6
+
+
+def main(iterations: int = 20000) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        data_protection.ENCRYPTION_KEY_FILE = os.path.join(tmp, ".key")
+        data_protection.reset_key_ring()
+
+        plaintexts = [f"Patient Name {i} / 0300-{i:07d}" for i in range(iterations)]
+        tokens = [data_protection.encrypt_data(p) for p in plaintexts]
+
+        results = {
+            "legacy_encrypt_us": _time_per_value(_legacy_encrypt, plaintexts),
+            "legacy_decrypt_us": _time_per_value(_legacy_decrypt, tokens),
+            "cached_encrypt_us": _time_per_value(data_protection.encrypt_data, plaintexts),
+            "cached_decrypt_us": _time_per_value(data_protection.decrypt_data, tokens),
+        }
+
+    print(f"[BENCH] {iterations} values per run (microseconds per value)")
+    for op in ("encrypt", "decrypt"):
+        before = results[f"legacy_{op}_us"]
+        after = results[f"cached_{op}_us"]
+        print(f"[BENCH] {op:<8} before {before:8.2f}  after {after:8.2f}  speedup {before / after:5.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,221 @@
+"""Backend hot paths at 10k / 100k / 1M rows, against throwaway databases.
+
+Run from the project root:
+    python -m benchmarks.bench_suite [--sizes 10000 100000] [--output results.json]
+    python -m benchmarks.bench_suite --save-baseline     # record benchmarks/baseline.json
+    python -m benchmarks.bench_suite --baseline benchmarks/baseline.json
+
+Each size seeds a fresh temp database with that many patients and log rows
+(half of them older than the retention window). Results are JSON; with
+--baseline, any metric worse than the baseline by more than --tolerance is
+reported and the exit status is 1. Baselines are machine-specific: record
+one on the machine that runs the comparison.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from backend import data_protection, db, logs, sql_trace
+from backend.patients import get_diagnosis_stats
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_TOLERANCE = 0.30
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+SEED_BATCH = 50_000
+LATENCY_ROUNDS = 3
+DIAGNOSES = ("Flu", "Diabetes", "Hypertension", "Asthma", "Migraine", "Covid-19", "Fracture", "Allergy")
+
+# Only these are compared with the baseline; p95 and totals are recorded
+# but too noisy (or redundant) to gate on.
+HIGHER_IS_BETTER = ("_per_sec",)
+LOWER_IS_BETTER = ("p50_ms",)
+# Sub-millisecond latencies jitter by more than the tolerance on their own.
+MIN_LATENCY_DELTA_MS = 0.05
+
+
+def _seed(rows: int) -> None:
+    now = int(time.time())
+    old = now - 200 * 86400
+    rng = random.Random(rows)
+
+    def timestamps(i):
+        ts = old - i if i % 2 else now - i
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), ts
+
+    with db.get_connection() as conn:
+        for start in range(0, rows, SEED_BATCH):
+            batch = range(start, min(start + SEED_BATCH, rows))
+            conn.executemany(
+                "INSERT INTO patients (name, contact, diagnosis, created_at, created_ts) VALUES (?, ?, ?, ?, ?);",
+                ((f"Patient {i}", f"0300-{i:07d}", rng.choice(DIAGNOSES), *timestamps(i)) for i in batch),
+            )
+            conn.executemany(
+                "INSERT INTO logs (username, role, action, details, created_at, created_ts) VALUES (?, ?, ?, ?, ?, ?);",
+                (("doctor", "doctor", "view_patient", f"patient_id={i}", *timestamps(i)) for i in batch),
+            )
+            conn.commit()
+
+
+def _latency(fn, calls: int, rounds: int = LATENCY_ROUNDS) -> dict:
+    # Best of several rounds: a single round's median moves with whatever
+    # else the machine is doing.
+    medians, samples = [], []
+    for _ in range(rounds):
+        round_samples = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            fn()
+            round_samples.append(time.perf_counter() - started)
+        medians.append(sorted(round_samples)[len(round_samples) // 2])
+        samples += round_samples
+    samples.sort()
+    return {
+        "p50_ms": min(medians) * 1000,
+        "p95_ms": samples[int(len(samples) * 0.95)] * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+    }
+
+
+def _throughput(fn, count: int, unit: str = "ops") -> dict:
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    return {f"{unit}_per_sec": count / elapsed if elapsed else 0.0, "total_seconds": elapsed}
+
+
+def _run_size(rows: int, tmp: str) -> dict:
+    db.DB_PATH = os.path.join(tmp, "hospital.db")
+    db.DB_BACKUP_DIR = os.path.join(tmp, "backups")
+    data_protection.ENCRYPTION_KEY_FILE = os.path.join(tmp, ".key")
+    data_protection.reset_key_ring()
+    # Seeding 1M rows trips the slow-query threshold; keep that out of data/.
+    sql_trace.SLOW_QUERY_LOG = os.path.join(tmp, "slow_queries.log")
+    db.init_db()
+    _seed(rows)
+
+    results = {}
+    calls = min(rows, 10_000)
+
+    def log_burst():
+        for i in range(calls):
+            logs.log_action("bench", "admin", "bench_action", f"entry {i}")
+        logs.flush_logs()
+
+    results["log_action"] = _throughput(log_burst, calls)
+    results["log_action_sync"] = _latency(lambda: logs.log_action("bench", "admin", "bench_sync", sync=True), 500)
+    results["get_logs"] = _latency(lambda: logs.get_logs(100), 200)
+
+    values = [f"Patient Name {i} / 0300-{i:07d}" for i in range(min(rows, 20_000))]
+    tokens = [data_protection.encrypt_data(v) for v in values]
+    results["encrypt_data"] = _throughput(lambda: [data_protection.encrypt_data(v) for v in values], len(values))
+    results["decrypt_data"] = _throughput(lambda: [data_protection.decrypt_data(t) for t in tokens], len(tokens))
+
+    results["dashboard_stats"] = _latency(get_diagnosis_stats, 200)
+    with db.get_connection() as conn:
+        results["diagnosis_group_by"] = _latency(
+            lambda: conn.execute("SELECT diagnosis, COUNT(*) FROM patients GROUP BY diagnosis;").fetchall(), 20
+        )
+
+    results["anonymize_all_patients"] = _throughput(lambda: data_protection.anonymize_all_patients(), rows, "rows")
+    ids = iter(random.Random(0).sample(range(1, rows + 1), min(rows, 200 * LATENCY_ROUNDS)))
+    results["anonymize_single_patient"] = _latency(lambda: data_protection.anonymize_single_patient(next(ids)), 200)
+
+    db_size = os.path.getsize(db.DB_PATH)
+    started = time.perf_counter()
+    db.create_database_backup()
+    elapsed = time.perf_counter() - started
+    results["create_database_backup"] = {"total_seconds": elapsed, "mb_per_sec": db_size / 1e6 / elapsed}
+
+    cleaned = {}
+    results["cleanup_old_data"] = _throughput(lambda: cleaned.update(logs.cleanup_old_data(90) or {}), rows, "rows")
+    results["cleanup_old_data"]["rows_deleted"] = cleaned.get("logs_deleted", 0) + cleaned.get("patients_deleted", 0)
+
+    db.close_pool()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for size, benchmarks in results["results"].items():
+        for name, metrics in benchmarks.items():
+            reference = baseline.get("results", {}).get(size, {}).get(name, {})
+            for metric, value in metrics.items():
+                before = reference.get(metric)
+                if not before:
+                    continue
+                if metric.endswith(HIGHER_IS_BETTER):
+                    change = (before - value) / before
+                elif metric.endswith(LOWER_IS_BETTER):
+                    if value - before < MIN_LATENCY_DELTA_MS:
+                        continue
+                    change = (value - before) / before
+                else:
+                    continue
+                if change > tolerance:
+                    regressions.append((size, name, metric, before, value, change))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_suite", description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Also write results to {BASELINE_PATH}")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": {},
+    }
+    for rows in args.sizes:
+        print(f"[BENCH] {rows} rows...", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp:
+            # The code under test prints per call; keep that cost but not the noise.
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results["results"][str(rows)] = _run_size(rows, tmp)
+        for name, metrics in results["results"][str(rows)].items():
+            summary = ", ".join(f"{k}={v:.2f}" for k, v in metrics.items())
+            print(f"[BENCH] {rows:>8} {name:<26} {summary}", file=sys.stderr)
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            f.write(payload)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for size, name, metric, before, after, change in regressions:
+            print(f"[BENCH] REGRESSION {size} {name}.{metric}: {before:.2f} -> {after:.2f} ({change:+.0%})",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"[BENCH] No regressions beyond {args.tolerance:.0%} against {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,20 @@
 import streamlit as st
 import pandas as pd
 import os
+from datetime import datetime
 
-from backend.db import get_connection, check_database_availability, create_database_backup, restore_from_backup
-from backend.logs import get_logs, log_action, cleanup_old_data
-from backend.data_protection import anonymize_all_patients, decrypt_data
-from frontend.layout import show_sidebar_navigation, show_dashboard_analytics
+from backend.db import DB_BACKUP_DIR, check_database_availability, create_database_backup, restore_from_backup, get_pool_stats, get_last_backup_stats, list_backups
+from backend.incremental_backup import create_incremental_backup, list_restore_points, restore_to_point_in_time, get_wal_archiver_stats
+from backend.exports import PYARROW_AVAILABLE, write_export
+from backend.log_archive import LOG_HOT_MONTHS, archive_old_logs, list_archived_months, query_logs, search_logs
+from backend.logs import get_logs, log_action, cleanup_old_data, get_log_writer_stats, iter_logs_csv, export_logs_to_parquet
+from backend.auth import get_login_stats
+from backend.data_protection import anonymize_all_patients, decrypt_data_cached, get_decryption_cache_stats
+from backend.cache import cached_read, get_query_cache_stats
+from backend.metrics import get_metrics_endpoint, render_metrics
+from backend.sql_trace import SLOW_QUERY_LOG, SLOW_QUERY_THRESHOLD, SQL_LATENCY_BUCKETS, get_recent_statements, get_slow_queries, get_sql_summary, reset_sql_trace
+from backend.patients import get_patients_page, iter_patients_csv, export_patients_to_parquet
+from frontend.layout import show_sidebar_navigation, show_dashboard_analytics, show_patient_filters, show_page_navigation, show_prepared_download
 
 
 def render_admin_view(user):
@@ -34,14 +43,23 @@ def render_admin_view(user):
         # -------------------
         with quick_col:
             st.markdown("#### Patient Data")
+            full_anonymize = st.checkbox("Re-encrypt every patient", key="anonymize_full",
+                                         help="By default only new or changed patients are processed")
             if st.button("Anonymize All Patients", use_container_width=True):
                 try:
                     backup = create_database_backup()
                     if backup:
                         st.info(f"Backup created: {os.path.basename(backup)}")
-                    anonymize_all_patients()
-                    log_action(user["username"], user["role"], "anonymize_all_patients", "Anonymization run")
-                    st.success("Anonymization Completed!")
+                    progress = st.progress(0.0, text="Anonymizing patients...")
+                    result = anonymize_all_patients(
+                        full=full_anonymize,
+                        progress_callback=lambda done, total: progress.progress(
+                            min(done / total, 1.0) if total else 1.0, text=f"Anonymized {done}/{total} patients"
+                        )
+                    )
+                    log_action(user["username"], user["role"], "anonymize_all_patients",
+                               f"Anonymization run {result['run_id']}: {result['processed']} patients")
+                    st.success(f"Anonymization Completed! {result['processed']} patients processed.")
                 except Exception as e:
                     st.error(f"Anonymization failed: {e}")
                     log_action(user["username"], user["role"], "anonymize_all_patients_failed", str(e)[:100])
@@ -55,6 +73,30 @@ def render_admin_view(user):
                     st.error("Database unavailable ❌")
                     log_action(user["username"], user["role"], "check_database_status_failed", "FAILED")
 
+                pool_stats = get_pool_stats()
+                st.caption(
+                    f"Connection pool: {pool_stats['in_use']}/{pool_stats['open']} in use, "
+                    f"hit rate {pool_stats['hit_rate']:.0%}, "
+                    f"{pool_stats['misses']} opened, {pool_stats['waits']} waits "
+                    f"({pool_stats['wait_time'] * 1000:.1f} ms)"
+                )
+                login_stats = get_login_stats()
+                ok_latency = login_stats["latency"]["success"]
+                failed_latency = login_stats["latency"]["failure"]
+                fmt = lambda v: "n/a" if v is None else f"≤{v * 1000:.0f} ms"
+                st.caption(
+                    f"Logins: {ok_latency['count']} ok (p50 {fmt(ok_latency['p50'])}, p95 {fmt(ok_latency['p95'])}), "
+                    f"{failed_latency['count']} failed (p95 {fmt(failed_latency['p95'])}), "
+                    f"{login_stats['latency']['locked']['count']} refused while locked, "
+                    f"{login_stats['locked']} usernames locked now"
+                )
+                cache_stats = get_query_cache_stats()
+                st.caption(
+                    f"Query cache: {cache_stats['size']}/{cache_stats['max_entries']} entries, "
+                    f"hit rate {cache_stats['hit_rate']:.0%}, "
+                    f"{cache_stats['stale']} invalidated by writes, {cache_stats['expired']} expired"
+                )
+
         # -------------------
         # System Management
         # -------------------
@@ -63,11 +105,18 @@ def render_admin_view(user):
             sys1, sys2, sys3 = st.columns(3)
 
             with sys1:
+                compression = st.selectbox("Compression", ["none", "gzip", "lzma"], key="backup_compression")
                 if st.button("Create Backup", use_container_width=True):
                     try:
-                        backup_path = create_database_backup()
+                        backup_path = create_database_backup(None if compression == "none" else compression)
                         if backup_path:
                             st.success(f"Backup created: {os.path.basename(backup_path)}")
+                            backup_stats = get_last_backup_stats()
+                            st.caption(
+                                f"{backup_stats['bytes_copied'] / 1024 / 1024:.1f} MiB copied at "
+                                f"{backup_stats['bytes_per_second'] / 1024 / 1024:.1f} MiB/s, "
+                                f"{backup_stats['file_size'] / 1024 / 1024:.1f} MiB on disk"
+                            )
                             log_action(user["username"], user["role"], "create_backup", backup_path)
                         else:
                             st.warning("Backup failed")
@@ -75,29 +124,64 @@ def render_admin_view(user):
                         st.error(f"Backup failed: {e}")
                         log_action(user["username"], user["role"], "backup_failed", str(e)[:100])
 
+                if st.button("Incremental Backup", use_container_width=True):
+                    result = create_incremental_backup()
+                    if result:
+                        if result["kind"] == "full":
+                            st.success(f"Started new chain with a full base ({result['bytes_written'] / 1024 / 1024:.1f} MiB)")
+                        else:
+                            st.success(f"Archived {result['frames']} changed pages ({result['bytes_written'] / 1024:.0f} KiB)")
+                        log_action(user["username"], user["role"], "incremental_backup", result["chain"])
+                    else:
+                        st.warning("Incremental backup failed")
+                archiver_stats = get_wal_archiver_stats()
+                st.caption(
+                    f"WAL archiver {'running' if archiver_stats['running'] else 'stopped'}, "
+                    f"every {archiver_stats['interval']:.0f}s, last run {archiver_stats['last_run'] or 'never'}"
+                )
+
             with sys2:
                 st.markdown("**Restore Backup**")
-                backup_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "backups")
-                if os.path.exists(backup_dir):
-                    backups = sorted(os.listdir(backup_dir), reverse=True)
-                    if backups:
-                        selected_backup = st.selectbox("Select backup", backups, key="backup_select")
-                        if st.button("Restore", use_container_width=True):
-                            backup_path = os.path.join(backup_dir, selected_backup)
-                            try:
-                                if restore_from_backup(backup_path):
-                                    st.success(f"Restored: {selected_backup}")
-                                    log_action(user["username"], user["role"], "restore_backup", selected_backup)
-                                    st.rerun()
-                                else:
-                                    st.error("Restore failed")
-                            except Exception as e:
-                                st.error(f"Restore error: {e}")
-                                log_action(user["username"], user["role"], "restore_backup_error", str(e)[:100])
-                    else:
-                        st.info("No backups available")
+                backups = list_backups()
+                if backups:
+                    labels = {
+                        f"{b['created_at']} · {b['size'] / 1024 / 1024:.1f} MiB"
+                        + (f" · {b['row_counts']['patients']} patients" if b.get("row_counts") else ""): b
+                        for b in backups
+                    }
+                    selected_label = st.selectbox("Select backup", list(labels), key="backup_select")
+                    if st.button("Restore", use_container_width=True):
+                        selected_backup = labels[selected_label]["file"]
+                        backup_path = os.path.join(DB_BACKUP_DIR, selected_backup)
+                        try:
+                            if restore_from_backup(backup_path):
+                                st.success(f"Restored: {selected_backup}")
+                                log_action(user["username"], user["role"], "restore_backup", selected_backup, sync=True)
+                                st.rerun()
+                            else:
+                                st.error("Restore failed")
+                        except Exception as e:
+                            st.error(f"Restore error: {e}")
+                            log_action(user["username"], user["role"], "restore_backup_error", str(e)[:100])
                 else:
-                    st.info("Backup directory not created")
+                    st.info("No backups available")
+
+                with st.expander("Point-in-time restore"):
+                    restore_points = list_restore_points()
+                    if restore_points:
+                        st.caption(f"Earliest: {restore_points[-1]['created_at']} · latest: {restore_points[0]['created_at']}")
+                        pitr_date = st.date_input("Date", key="pitr_date")
+                        pitr_time = st.time_input("Time", key="pitr_time", step=60)
+                        if st.button("Restore to this time", use_container_width=True):
+                            target = datetime.combine(pitr_date, pitr_time)
+                            if restore_to_point_in_time(target):
+                                st.success(f"Restored to the last restore point before {target:%Y-%m-%d %H:%M}")
+                                log_action(user["username"], user["role"], "restore_point_in_time", f"{target:%Y-%m-%d %H:%M}", sync=True)
+                                st.rerun()
+                            else:
+                                st.error("Point-in-time restore failed")
+                    else:
+                        st.info("No incremental backups yet")
 
             with sys3:
                 st.markdown("**Data Retention**")
@@ -112,13 +196,31 @@ def render_admin_view(user):
                             st.success(
                                 f"Logs deleted: {result['logs_deleted']}\nPatients deleted: {result['patients_deleted']}"
                             )
-                            log_action(user["username"], user["role"], "data_retention_cleanup", f"{retention_days} days")
+                            st.caption(
+                                f"{result['batches']} batches, {result['rows_per_second']:.0f} rows/s, "
+                                f"longest lock hold {result['max_lock_hold'] * 1000:.1f} ms"
+                                + (f", {result['pages_freed']} pages released" if result["pages_freed"] is not None else "")
+                            )
+                            log_action(user["username"], user["role"], "data_retention_cleanup", f"{retention_days} days", sync=True)
                         else:
                             st.warning("Nothing to delete")
                     except Exception as e:
                         st.error(f"Cleanup error: {e}")
                         log_action(user["username"], user["role"], "data_retention_error", str(e)[:100])
 
+                if st.button("Archive Old Logs", use_container_width=True,
+                             help=f"Move logs older than the last {LOG_HOT_MONTHS} months into monthly archive files"):
+                    try:
+                        result = archive_old_logs()
+                        if result["rows"]:
+                            st.success(f"Archived {result['rows']} log entries from {', '.join(result['months'])}")
+                            log_action(user["username"], user["role"], "logs_archived", f"{result['rows']} entries", sync=True)
+                        else:
+                            st.info("No logs old enough to archive")
+                    except Exception as e:
+                        st.error(f"Archive error: {e}")
+                        log_action(user["username"], user["role"], "logs_archive_error", str(e)[:100])
+
     # -------------------
     # PATIENT LIST PAGE
     # -------------------
@@ -127,22 +229,29 @@ def render_admin_view(user):
         st.subheader("Full View (Decrypted + Anonymized)")
 
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT id, name, contact, diagnosis, anonymized_name, anonymized_contact,
-                       encrypted_name, encrypted_contact, created_at
-                FROM patients;
-            """)
-            patients = cur.fetchall()
-            conn.close()
+            query = show_patient_filters("admin_patients")
+            page = cached_read(user["role"], get_patients_page, **query)
+            patients = page["rows"]
 
             if patients:
+                # Decrypt on demand: the visible page, or only the rows the
+                # admin explicitly reveals. Repeat renders hit the cache.
+                reveal_all = st.toggle("Decrypt all rows on this page", value=True, key="admin_reveal_all")
+                if reveal_all:
+                    revealed_ids = {p["id"] for p in patients}
+                else:
+                    revealed_ids = set(st.multiselect(
+                        "Reveal patients (by ID)", [p["id"] for p in patients], key="admin_reveal_ids"
+                    ))
+
                 patients_data = []
                 for p in patients:
                     pdict = dict(p)
-                    pdict["decrypted_name"] = decrypt_data(pdict.get("encrypted_name")) or pdict.get("name", "N/A")
-                    pdict["decrypted_contact"] = decrypt_data(pdict.get("encrypted_contact")) or pdict.get("contact", "N/A")
+                    if pdict["id"] in revealed_ids:
+                        pdict["decrypted_name"] = decrypt_data_cached(pdict.get("encrypted_name")) or pdict.get("name", "N/A")
+                        pdict["decrypted_contact"] = decrypt_data_cached(pdict.get("encrypted_contact")) or pdict.get("contact", "N/A")
+                    else:
+                        pdict["decrypted_name"] = pdict["decrypted_contact"] = "🔒 hidden"
                     patients_data.append(pdict)
 
                 df_patients = pd.DataFrame(patients_data)
@@ -155,8 +264,22 @@ def render_admin_view(user):
                 }, inplace=True)
 
                 st.dataframe(df_display, use_container_width=True)
-                st.download_button("Download CSV", df_patients.to_csv(index=False), "patient_records.csv", "text/csv")
+                show_page_navigation("admin_patients", page)
+                # Built only on request, from the columns shown above; the file
+                # name carries the page's id range so another page's export
+                # is never offered here.
+                show_prepared_download("Page CSV", "export_patient_page",
+                                       lambda path: df_display.to_csv(path, index=False),
+                                       f"patient_records_{patients[0]['id']}-{patients[-1]['id']}.csv", "text/csv")
                 st.markdown(f"Showing {len(patients)} patients")
+
+                cache_stats = get_decryption_cache_stats()
+                st.caption(
+                    f"Decryption cache: {cache_stats['size']}/{cache_stats['max_entries']} entries, "
+                    f"hit rate {cache_stats['hit_rate']:.0%} "
+                    f"({cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                    f"{cache_stats['evictions']} evicted, {cache_stats['expirations']} expired)"
+                )
             else:
                 st.info("No patients yet")
 
@@ -173,41 +296,195 @@ def render_admin_view(user):
         st.header("Audit Logs")
         st.markdown("Complete audit trail of system activities for GDPR compliance.")
 
+        search_col1, search_col2, search_col3 = st.columns([3, 1, 1])
+        with search_col1:
+            search_text = st.text_input("Search logs", placeholder="e.g. patient_id=42, decryption failed",
+                                        key="log_search_text").strip()
+        with search_col2:
+            search_user = st.text_input("Username", key="log_search_user").strip() or None
+        with search_col3:
+            search_role = st.selectbox("Role", ["Any", "admin", "doctor", "receptionist"], key="log_search_role")
+        if search_text:
+            search_range = st.date_input("Date range", value=(), key="log_search_range")
+            start_ts = end_ts = None
+            if len(search_range) == 2:
+                start_ts = int(datetime.combine(search_range[0], datetime.min.time()).timestamp())
+                end_ts = int(datetime.combine(search_range[1], datetime.max.time()).timestamp())
+
+            # A new query starts again from the first page.
+            signature = (search_text, search_user, search_role, start_ts, end_ts)
+            if st.session_state.get("log_search_signature") != signature:
+                st.session_state["log_search_signature"] = signature
+                st.session_state["log_search_page"] = 1
+            page = st.session_state["log_search_page"]
+
+            try:
+                found = search_logs(search_text, username=search_user,
+                                    role=None if search_role == "Any" else search_role,
+                                    start_ts=start_ts, end_ts=end_ts, page=page)
+                if found["rows"]:
+                    df_found = pd.DataFrame([dict(r) for r in found["rows"]])
+                    st.dataframe(df_found[["created_at", "username", "role", "action", "snippet"]],
+                                 use_container_width=True)
+                    pages = max(1, -(-found["total"] // found["page_size"]))
+                    nav1, nav2, nav3 = st.columns([1, 2, 1])
+                    with nav1:
+                        if st.button("◀ Previous", key="log_search_prev", disabled=page <= 1, use_container_width=True):
+                            st.session_state["log_search_page"] = page - 1
+                            st.rerun()
+                    with nav2:
+                        st.markdown(
+                            f"<p style='text-align:center;'>Page {page} of {pages} · {found['total']} matches</p>",
+                            unsafe_allow_html=True,
+                        )
+                    with nav3:
+                        if st.button("Next ▶", key="log_search_next", disabled=page >= pages, use_container_width=True):
+                            st.session_state["log_search_page"] = page + 1
+                            st.rerun()
+                else:
+                    st.info("No matching log entries")
+            except Exception as e:
+                st.error(f"Search error: {e}")
+            st.divider()
+
         try:
-            logs = get_logs(100)
+            logs = cached_read(user["role"], get_logs, 100)
             if logs:
                 df_logs = pd.DataFrame([dict(l) for l in logs])
                 st.dataframe(df_logs, use_container_width=True)
+            else:
+                st.info("No recent logs")
 
-                dl_col1, dl_col2 = st.columns(2)
-                with dl_col1:
-                    st.download_button("Download Logs CSV", df_logs.to_csv(index=False), "audit_logs.csv", "text/csv")
-                with dl_col2:
-                    try:
-                        conn = get_connection()
-                        cur = conn.cursor()
-                        cur.execute("SELECT * FROM patients;")
-                        patients = cur.fetchall()
-                        conn.close()
-                        if patients:
-                            df_pat = pd.DataFrame([dict(p) for p in patients])
-                            st.download_button("Download Patients CSV", df_pat.to_csv(index=False), "patients.csv", "text/csv")
-                    except Exception as e:
-                        st.warning(f"Could not export patients: {e}")
+            # Exports and archive search cover archived months too, so they
+            # stay available when the hot table is empty (e.g. right after
+            # archiving or a month rollover).
+            formats = ["CSV", "CSV (gzip)"] + (["Parquet"] if PYARROW_AVAILABLE else [])
+            export_format = st.radio("Export format", formats, horizontal=True, key="export_format")
+            if not PYARROW_AVAILABLE:
+                st.caption("Install pyarrow to enable Parquet exports.")
+            dl_col1, dl_col2 = st.columns(2)
+            with dl_col1:
+                if export_format == "Parquet":
+                    show_prepared_download("Logs", "export_logs", export_logs_to_parquet,
+                                           "audit_logs.parquet", "application/vnd.apache.parquet")
+                else:
+                    compress = export_format == "CSV (gzip)"
+                    show_prepared_download("Logs", "export_logs",
+                                           lambda path: write_export(path, iter_logs_csv(compress)),
+                                           "audit_logs.csv.gz" if compress else "audit_logs.csv",
+                                           "application/gzip" if compress else "text/csv")
+            with dl_col2:
+                try:
+                    if export_format == "Parquet":
+                        show_prepared_download("Patients", "export_patients", export_patients_to_parquet,
+                                               "patients.parquet", "application/vnd.apache.parquet")
+                    else:
+                        show_prepared_download("Patients", "export_patients",
+                                               lambda path: write_export(path, iter_patients_csv(compress)),
+                                               "patients.csv.gz" if compress else "patients.csv",
+                                               "application/gzip" if compress else "text/csv")
+                except Exception as e:
+                    st.warning(f"Could not export patients: {e}")
 
-                st.divider()
+            st.divider()
+            if logs:
                 st.markdown("### Activity Overview")
                 if "action" in df_logs.columns:
                     st.bar_chart(df_logs["action"].value_counts(), color="#dc2626")
                 st.markdown(f"Showing {len(logs)} recent entries")
-            else:
-                st.info("No logs yet")
+
+            archived = list_archived_months()
+            if archived:
+                # Empty or purged months have no min_ts; fall back to the month itself.
+                earliest_ts = min((m["min_ts"] for m in archived if m["min_ts"] is not None), default=None)
+                earliest = (datetime.fromtimestamp(earliest_ts) if earliest_ts is not None
+                            else datetime.strptime(archived[-1]["month"], "%Y-%m"))
+                with st.expander(f"Search archived logs ({len(archived)} months)"):
+                    arc_col1, arc_col2, arc_col3 = st.columns(3)
+                    with arc_col1:
+                        arc_from = st.date_input("From", value=earliest.date(), key="archive_from")
+                    with arc_col2:
+                        arc_to = st.date_input("To", value=datetime.now().date(), key="archive_to")
+                    with arc_col3:
+                        arc_user = st.text_input("Username", key="archive_user").strip() or None
+                    start_ts = int(datetime.combine(arc_from, datetime.min.time()).timestamp())
+                    end_ts = int(datetime.combine(arc_to, datetime.max.time()).timestamp())
+                    arc_logs = query_logs(500, start_ts=start_ts, end_ts=end_ts, username=arc_user)
+                    if arc_logs:
+                        st.dataframe(pd.DataFrame([dict(l) for l in arc_logs]), use_container_width=True)
+                    else:
+                        st.info("No log entries in this range")
+
+            writer_stats = get_log_writer_stats()
+            st.caption(
+                f"Log writer: {writer_stats['queue_depth']}/{writer_stats['queue_max']} queued, "
+                f"{writer_stats['written']} written in {writer_stats['flushes']} flushes, "
+                f"avg flush {writer_stats['avg_flush_time'] * 1000:.1f} ms "
+                f"(max {writer_stats['max_flush_time'] * 1000:.1f} ms), "
+                f"{writer_stats['sync_fallbacks']} sync fallbacks"
+            )
         except Exception as e:
             st.error(f"Error loading audit logs: {e}")
             try:
                 log_action(user["username"], user["role"], "logs_view_error", str(e)[:100])
             except: pass
 
+    # -------------------
+    # DIAGNOSTICS PAGE
+    # -------------------
+    elif selected_page == "diagnostics":
+        st.header("Diagnostics")
+        st.markdown("SQL statements traced on every database connection since startup.")
+
+        summary = get_sql_summary(50)
+        if summary:
+            df_sql = pd.DataFrame([
+                {
+                    "Statement": row["statement"][:120],
+                    "Calls": row["count"],
+                    "Total (s)": round(row["total_seconds"], 3),
+                    "Mean (ms)": round(row["mean_ms"], 2),
+                    "p50 (ms)": None if row["p50_ms"] is None else round(row["p50_ms"], 2),
+                    "p95 (ms)": None if row["p95_ms"] is None else round(row["p95_ms"], 2),
+                    "p99 (ms)": None if row["p99_ms"] is None else round(row["p99_ms"], 2),
+                    "Max (ms)": round(row["max_ms"], 2),
+                    "Avg rows": round(row["avg_rows"], 1),
+                    "Top caller": row["top_caller"],
+                }
+                for row in summary
+            ])
+            st.markdown("### Statements by total time")
+            st.dataframe(df_sql, use_container_width=True)
+            st.caption("Percentiles cover the most recent statements; counts and totals are since startup.")
+
+            st.markdown("### Latency distribution")
+            labels = [f"≤{bound * 1000:g} ms" for bound in SQL_LATENCY_BUCKETS] + ["slower"]
+            totals = [sum(row["buckets"][i][1] for row in summary) for i in range(len(labels))]
+            st.bar_chart(pd.Series(totals, index=pd.Index(labels, name="latency")), color="#2563eb")
+        else:
+            st.info("No statements traced yet")
+
+        st.markdown(f"### Slow queries (≥ {SLOW_QUERY_THRESHOLD * 1000:.0f} ms)")
+        slow = get_slow_queries()
+        if slow:
+            st.dataframe(pd.DataFrame(slow), use_container_width=True)
+        else:
+            st.info("No slow queries recorded")
+        st.caption(f"Slow queries are also appended to {os.path.normpath(SLOW_QUERY_LOG)}")
+
+        with st.expander("Most recent statements"):
+            st.dataframe(pd.DataFrame(get_recent_statements(200)), use_container_width=True)
+
+        with st.expander("Prometheus metrics"):
+            endpoint = get_metrics_endpoint()
+            st.caption(f"Scrape {endpoint}" if endpoint else "Metrics endpoint not running in this process.")
+            st.code(render_metrics(), language="text")
+
+        if st.button("Reset SQL trace"):
+            reset_sql_trace()
+            log_action(user["username"], user["role"], "sql_trace_reset", "", sync=True)
+            st.rerun()
+
     try:
         log_action(user["username"], user["role"], "view_admin_dashboard", f"Viewed {selected_page}")
     except Exception as e:
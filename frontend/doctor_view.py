@@ -1,9 +1,10 @@
 import streamlit as st
 import pandas as pd
 
-from backend.db import get_connection
+from backend.cache import cached_read
 from backend.logs import log_action
-from frontend.layout import show_sidebar_navigation, show_dashboard_analytics
+from backend.patients import get_patients_page
+from frontend.layout import show_sidebar_navigation, show_dashboard_analytics, show_patient_filters, show_page_navigation
 
 
 def render_doctor_view(user):
@@ -20,22 +21,18 @@ def render_doctor_view(user):
         )
 
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            
-            cur.execute(
-                """
-                SELECT id, anonymized_name, anonymized_contact, diagnosis, created_at
-                FROM patients;
-                """
+            query = show_patient_filters("doctor_patients")
+            page = cached_read(
+                user["role"], get_patients_page,
+                ("id", "anonymized_name", "anonymized_contact", "diagnosis", "created_at"), **query
             )
-            patients = cur.fetchall()
-            conn.close()
+            patients = page["rows"]
 
             if patients:
                 patients_data = [dict(p) for p in patients]
                 df = pd.DataFrame(patients_data)
                 st.dataframe(df, use_container_width=True)
+                show_page_navigation("doctor_patients", page)
                 st.markdown(f"Viewing {len(patients)} patient records (anonymized)")
             else:
                 st.markdown("No patients in the system yet.")
@@ -1,7 +1,19 @@
 import streamlit as st
+import glob
+import os
+import tempfile
+import time
 from datetime import datetime
 import pandas as pd
-from backend.db import get_connection
+from backend.cache import cached_read
+from backend.data_protection import purge_decryption_cache
+from backend.patients import get_diagnosis_stats
+from backend.sql_trace import set_current_view
+
+# Prepared exports can hold decrypted PII. They are deleted on logout, and
+# any left by sessions that never logged out are swept once this old.
+PREPARED_DOWNLOAD_PREFIX = "hms_"
+PREPARED_DOWNLOAD_MAX_AGE = 3600.0
 
 # --------------------------
 # 🎨 GLOBAL STYLING
@@ -119,6 +131,7 @@ def show_sidebar_navigation(user):
         pages = ["Dashboard", "Patient List"]
         if user["role"] == "admin":
             pages.append("Audit Logs")
+            pages.append("Diagnostics")
 
         selected_page = None
         for page in pages:
@@ -132,13 +145,21 @@ def show_sidebar_navigation(user):
 
         st.divider()
         if st.button("Logout", use_container_width=True):
+            if user["role"] == "admin":
+                purge_decryption_cache()
+            discard_prepared_downloads()
+            sweep_stale_downloads()
             st.session_state["user"] = None
             st.session_state.pop("selected_page", None)
             st.rerun()
 
         # Return internal page identifier
-        mapping = {"Dashboard": "dashboard", "Patient List": "patient_list", "Audit Logs": "logs"}
-        return mapping.get(st.session_state["selected_page"], "dashboard")
+        mapping = {"Dashboard": "dashboard", "Patient List": "patient_list", "Audit Logs": "logs",
+                   "Diagnostics": "diagnostics"}
+        selected = mapping.get(st.session_state["selected_page"], "dashboard")
+        # SQL traced for the rest of this run is attributed to this page.
+        set_current_view(f"{user['role']}/{selected}")
+        return selected
 
 # --------------------------
 # DASHBOARD ANALYTICS
@@ -146,14 +167,7 @@ def show_sidebar_navigation(user):
 def show_dashboard_analytics(user):
     st.markdown("## Dashboard Analytics")
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM patients;")
-        total_patients = cur.fetchone()[0]
-
-        cur.execute("SELECT diagnosis, COUNT(*) FROM patients GROUP BY diagnosis;")
-        diagnosis_data = cur.fetchall()
-        conn.close()
+        total_patients, diagnosis_data = cached_read(user["role"], get_diagnosis_stats)
 
         col1, col2 = st.columns(2)
         with col1: st.metric("Total Patients", total_patients)
@@ -162,9 +176,119 @@ def show_dashboard_analytics(user):
 
         if diagnosis_data:
             st.markdown("### Patients by Diagnosis")
-            df_diag = pd.DataFrame(diagnosis_data, columns=["Diagnosis", "Count"])
+            df_diag = pd.DataFrame(
+                [(diagnosis or "Unspecified", count) for diagnosis, count in diagnosis_data],
+                columns=["Diagnosis", "Count"],
+            )
             st.bar_chart(df_diag.set_index("Diagnosis"), color="#dc2626")
 
     except Exception as e:
         st.error(f"Error loading dashboard: {e}")
         print(f"[DASHBOARD ERROR] {e}")
+
+# --------------------------
+# PATIENT LIST PAGINATION
+# --------------------------
+def show_patient_filters(key):
+    with st.expander("Filters & Paging"):
+        col1, col2 = st.columns(2)
+        with col1:
+            diagnosis = st.text_input("Diagnosis", key=f"{key}_diagnosis").strip()
+            date_range = st.date_input("Created between", value=(), key=f"{key}_dates")
+        with col2:
+            order = st.selectbox("Sort by", ["Oldest first", "Newest first"], key=f"{key}_order")
+            page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1, key=f"{key}_page_size")
+
+    query = {
+        "page_size": page_size,
+        "descending": order == "Newest first",
+        "diagnosis": diagnosis or None,
+        "date_from": int(datetime.combine(date_range[0], datetime.min.time()).timestamp()) if date_range else None,
+        "date_to": int(datetime.combine(date_range[-1], datetime.max.time()).timestamp()) if date_range else None,
+    }
+
+    # Cursor stack for Previous/Next; any filter change starts over at page 1.
+    signature = tuple(sorted(query.items()))
+    if st.session_state.get(f"{key}_signature") != signature:
+        st.session_state[f"{key}_signature"] = signature
+        st.session_state[f"{key}_cursors"] = [None]
+
+    query["after_id"] = st.session_state[f"{key}_cursors"][-1]
+    return query
+
+
+def show_page_navigation(key, page):
+    cursors = st.session_state[f"{key}_cursors"]
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("◀ Previous", key=f"{key}_prev", disabled=len(cursors) <= 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        # total_kind is "exact" or "lower_bound" (see patients._estimate_total).
+        total = page["estimated_total"]
+        if page["total_kind"] == "lower_bound":
+            total = f"{total}+"
+        st.markdown(
+            f"<p style='text-align:center;'>Page {len(cursors)} · {total} patients</p>",
+            unsafe_allow_html=True,
+        )
+    with col3:
+        if st.button("Next ▶", key=f"{key}_next", disabled=not page["has_more"], use_container_width=True):
+            cursors.append(page["next_cursor"])
+            st.rerun()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def sweep_stale_downloads(max_age=PREPARED_DOWNLOAD_MAX_AGE):
+    # Files from expired sessions, which never reach discard_prepared_downloads().
+    cutoff = time.time() - max_age
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{PREPARED_DOWNLOAD_PREFIX}*")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def discard_prepared_downloads():
+    for key in st.session_state.pop("prepared_download_keys", []):
+        prepared = st.session_state.pop(key, None)
+        if prepared:
+            _remove_quietly(prepared["path"])
+
+
+def show_prepared_download(label, key, write, file_name, mime):
+    # Nothing is read until "Prepare" is clicked; write(path) then streams
+    # the export to a temp file so it never sits in memory as one string.
+    if st.button(f"Prepare {label}", key=f"{key}_prepare", use_container_width=True):
+        sweep_stale_downloads()
+        previous = st.session_state.pop(key, None)
+        if previous:
+            _remove_quietly(previous["path"])
+        fd, path = tempfile.mkstemp(prefix=f"{PREPARED_DOWNLOAD_PREFIX}{key}_", suffix=os.path.splitext(file_name)[1])
+        os.close(fd)
+        with st.spinner(f"Exporting {label}..."):
+            ok = write(path)
+        if ok is False:
+            _remove_quietly(path)
+            st.warning(f"Could not export {label}")
+        else:
+            st.session_state[key] = {"path": path, "file_name": file_name, "size": os.path.getsize(path)}
+            keys = st.session_state.setdefault("prepared_download_keys", [])
+            if key not in keys:
+                keys.append(key)
+
+    prepared = st.session_state.get(key)
+    if prepared and prepared["file_name"] == file_name and os.path.exists(prepared["path"]):
+        with open(prepared["path"], "rb") as f:
+            st.download_button(
+                f"Download {label} ({prepared['size'] / 1024 / 1024:.1f} MiB)", f, prepared["file_name"],
+                mime, key=f"{key}_download", use_container_width=True,
+            )
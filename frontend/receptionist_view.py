@@ -2,10 +2,12 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 
+from backend.cache import bump_data_version, cached_read
 from backend.db import get_connection
 from backend.logs import log_action
 from backend.data_protection import anonymize_name, anonymize_contact, encrypt_data
-from frontend.layout import show_sidebar_navigation, show_dashboard_analytics
+from backend.patients import get_patients_page
+from frontend.layout import show_sidebar_navigation, show_dashboard_analytics, show_patient_filters, show_page_navigation
 
 
 def render_receptionist_view(user):
@@ -26,16 +28,11 @@ def render_receptionist_view(user):
         # ------------------------------
         st.subheader("All Patients")
         try:
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute(
-                """
-                SELECT id, name, contact, diagnosis, created_at
-                FROM patients;
-                """
+            query = show_patient_filters("receptionist_patients")
+            page = cached_read(
+                user["role"], get_patients_page, ("id", "name", "contact", "diagnosis", "created_at"), **query
             )
-            patients = cur.fetchall()
-            conn.close()
+            patients = page["rows"]
 
             if patients:
                 patients_data = [dict(p) for p in patients]
@@ -46,7 +43,7 @@ def render_receptionist_view(user):
                 df.rename(columns={'contact_masked': 'contact'}, inplace=True)
                 
                 st.dataframe(df, use_container_width=True)
-                st.markdown(f"Total patients: {len(patients)}")
+                show_page_navigation("receptionist_patients", page)
             else:
                 st.markdown("No patients in the system yet.")
                 
@@ -89,36 +86,37 @@ def render_receptionist_view(user):
                     st.error("Name and contact are required.")
                 else:
                     try:
-                        conn = get_connection()
-                        cur = conn.cursor()
-                        
-                        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        cur.execute(
-                            """
-                            INSERT INTO patients (name, contact, diagnosis, created_at)
-                            VALUES (?, ?, ?, ?);
-                            """,
-                            (name, contact, diagnosis, current_time),
-                        )
-                        
-                        patient_id = cur.lastrowid
+                        with get_connection() as conn:
+                            cur = conn.cursor()
+                            
+                            now = datetime.now()
+                            cur.execute(
+                                """
+                                INSERT INTO patients (name, contact, diagnosis, created_at, created_ts)
+                                VALUES (?, ?, ?, ?, ?);
+                                """,
+                                (name, contact, diagnosis, now.strftime("%Y-%m-%d %H:%M:%S"), int(now.timestamp())),
+                            )
+                            
+                            patient_id = cur.lastrowid
 
-                        anon_name = anonymize_name(name, patient_id)
-                        anon_contact = anonymize_contact(contact)
-                        enc_name = encrypt_data(name)
-                        enc_contact = encrypt_data(contact)
+                            anon_name = anonymize_name(name, patient_id)
+                            anon_contact = anonymize_contact(contact)
+                            enc_name = encrypt_data(name)
+                            enc_contact = encrypt_data(contact)
 
-                        cur.execute(
-                            """
-                            UPDATE patients
-                            SET anonymized_name = ?, anonymized_contact = ?, encrypted_name = ?, encrypted_contact = ?
-                            WHERE id = ?;
-                            """,
-                            (anon_name, anon_contact, enc_name, enc_contact, patient_id),
-                        )
-                        
-                        conn.commit()
-                        conn.close()
+                            cur.execute(
+                                """
+                                UPDATE patients
+                                SET anonymized_name = ?, anonymized_contact = ?, encrypted_name = ?, encrypted_contact = ?,
+                                    anonymization_dirty = 0
+                                WHERE id = ?;
+                                """,
+                                (anon_name, anon_contact, enc_name, enc_contact, patient_id),
+                            )
+                            
+                            conn.commit()
+                        bump_data_version("patients")
 
                         st.success(f"Patient saved with ID {patient_id}.")
 